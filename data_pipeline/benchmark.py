@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+"""
+Run the data pipeline end to end on synthetic data and record timings and output sizes.
+
+Steps:
+1. prepare - generate and validate gene models, gene results, and variant results tables
+2. combine - combine datasets with gene models
+3. write - write results files from the combined table
+
+Results of each run are written to `{output_directory}/benchmark-{start time}.json`.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+
+def get_directory_size(path):
+    """
+    Get number of files and total size in bytes of a directory.
+    """
+    n_files = 0
+    n_bytes = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            n_files += 1
+            n_bytes += os.path.getsize(os.path.join(root, name))
+    return {"n_files": n_files, "n_bytes": n_bytes}
+
+
+def get_results_files_sizes(results_directory):
+    """
+    Get number of files and total size in bytes of results files by type of file.
+    """
+    sizes = {}
+    for root, _, files in os.walk(results_directory):
+        for name in files:
+            if name.startswith("ENS"):
+                # Group gene files by suffix, for example `_GRCh37.json` or `_dataset_variants.json`
+                file_type = "genes/*" + name[name.index("_") :]
+            else:
+                file_type = os.path.relpath(os.path.join(root, name), results_directory)
+
+            file_type_sizes = sizes.setdefault(file_type, {"n_files": 0, "n_bytes": 0})
+            file_type_sizes["n_files"] += 1
+            file_type_sizes["n_bytes"] += os.path.getsize(os.path.join(root, name))
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output_directory", help="Local directory for synthetic data, Hail tables, and results files")
+    parser.add_argument("--genes", type=int, default=1000, help="Number of genes (defaults to %(default)s)")
+    parser.add_argument("--datasets", type=int, default=2, help="Number of datasets (defaults to %(default)s)")
+    parser.add_argument(
+        "--analysis-groups", type=int, default=3, help="Number of analysis groups per dataset (defaults to %(default)s)"
+    )
+    parser.add_argument(
+        "--min-variants-per-gene",
+        type=int,
+        default=10,
+        help="Minimum of the Pareto distribution of variants per gene (defaults to %(default)s)",
+    )
+    parser.add_argument(
+        "--variants-tail-index",
+        type=float,
+        default=1.2,
+        help="Shape of the Pareto distribution of variants per gene; smaller values give more large genes "
+        "(defaults to %(default)s)",
+    )
+    parser.add_argument(
+        "--max-variants-per-gene",
+        type=int,
+        default=50000,
+        help="Maximum number of variants per gene (defaults to %(default)s)",
+    )
+    parser.add_argument("--partitions", type=int, help="Number of partitions for generated tables")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (defaults to %(default)s)")
+    parser.add_argument("--processes", type=int, help="Number of worker processes for writing results files")
+    parser.add_argument(
+        "--skip-prepare", action="store_true", help="Reuse synthetic tables generated by a previous run"
+    )
+    args = parser.parse_args()
+
+    output_directory = os.path.abspath(args.output_directory)
+    staging_path = os.path.join(output_directory, "staging")
+    results_directory = os.path.join(output_directory, "results")
+
+    # Set working directory so that config.py finds pipeline_config.ini
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    # pylint: disable=import-outside-toplevel
+    import hail as hl
+
+    from data_pipeline.config import pipeline_config
+    from data_pipeline.metrics import pipeline_metrics, step
+    from data_pipeline.pipelines.combine_datasets import combine_datasets
+    from data_pipeline.synthetic_data import generate_gene_models, generate_gene_results, generate_variant_results
+    from data_pipeline.validation import validate_gene_results_table, validate_variant_results_table
+    from write_results_files import write_data_files
+
+    # pylint: enable=import-outside-toplevel
+
+    # Pipelines read and write tables in the staging path
+    pipeline_config.set("output", "staging_path", staging_path)
+
+    hl.init(global_seed=args.seed)
+
+    start_time = datetime.datetime.utcnow()
+    dataset_ids = [f"SYN{i + 1}" for i in range(args.datasets)]
+    timings = {}
+
+    with pipeline_metrics("benchmark"):
+        if not args.skip_prepare:
+            step_start_time = time.time()
+
+            gene_models_path = os.path.join(staging_path, "gene_models.ht")
+            with step("gene_models.write", output_path=gene_models_path):
+                generate_gene_models(args.genes, n_partitions=args.partitions).write(gene_models_path, overwrite=True)
+
+            gene_models = hl.read_table(gene_models_path)
+            for dataset_id in dataset_ids:
+                analysis_groups = [f"{dataset_id}_group{i + 1}" for i in range(args.analysis_groups)]
+
+                gene_results = generate_gene_results(gene_models, analysis_groups)
+                validate_gene_results_table(gene_results)
+                gene_results_path = os.path.join(staging_path, dataset_id.lower(), "gene_results.ht")
+                with step(f"{dataset_id.lower()}.gene_results.write", output_path=gene_results_path):
+                    gene_results.write(gene_results_path, overwrite=True)
+
+                variant_results = generate_variant_results(
+                    gene_models,
+                    analysis_groups,
+                    min_variants_per_gene=args.min_variants_per_gene,
+                    tail_index=args.variants_tail_index,
+                    max_variants_per_gene=args.max_variants_per_gene,
+                )
+                validate_variant_results_table(variant_results)
+                variant_results_path = os.path.join(staging_path, dataset_id.lower(), "variant_results.ht")
+                with step(f"{dataset_id.lower()}.variant_results.write", output_path=variant_results_path):
+                    variant_results.write(variant_results_path, overwrite=True)
+
+            timings["prepare"] = time.time() - step_start_time
+
+        step_start_time = time.time()
+        combined_path = os.path.join(staging_path, "combined.ht")
+        combined = combine_datasets(dataset_ids)
+        with step("combined.write", output_path=combined_path):
+            combined.write(combined_path, overwrite=True)
+        timings["combine"] = time.time() - step_start_time
+
+        step_start_time = time.time()
+        write_data_files(combined_path, results_directory, processes=args.processes)
+        timings["write"] = time.time() - step_start_time
+
+    n_variants = {
+        dataset_id: hl.read_table(os.path.join(staging_path, dataset_id.lower(), "variant_results.ht")).count()
+        for dataset_id in dataset_ids
+    }
+
+    report = {
+        "start_time": start_time.isoformat() + "Z",
+        "parameters": vars(args),
+        "timings": timings,
+        "n_variants": n_variants,
+        "sizes": {
+            "staging": {
+                table: get_directory_size(os.path.join(staging_path, table))
+                for table in ["gene_models.ht", "combined.ht"]
+                + [
+                    f"{dataset_id.lower()}/{name}"
+                    for dataset_id in dataset_ids
+                    for name in ["gene_results.ht", "variant_results.ht"]
+                ]
+            },
+            "results": get_results_files_sizes(results_directory),
+        },
+    }
+
+    report_path = os.path.join(output_directory, f"benchmark-{start_time.strftime('%Y%m%dT%H%M%SZ')}.json")
+    with open(report_path, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+
+    for step_name, elapsed_time in timings.items():
+        print(f"{step_name}: {elapsed_time:.1f}s")
+    print(f"Wrote benchmark report to {report_path}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
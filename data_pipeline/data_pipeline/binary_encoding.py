@@ -0,0 +1,218 @@
+"""
+Compact binary encoding of variant lists, generated from the field names and types that
+combine_datasets records for each dataset in the combined table's metadata.
+
+Variants are stored column by column. An encoded list of variants is:
+
+- the bytes `ERBV` and a format version byte
+- the number of variants (varint)
+- a column for each of the metadata's `variant_fields`, except that `info` is stored as one column
+  for each of the dataset's `variant_info_field_names` and `group_results` is stored as, for each of
+  the dataset's `variant_result_analysis_groups`, a bitmap of which variants have a result in that
+  group followed by one column for each of `variant_group_result_field_names` containing values for
+  only those variants
+
+Columns are encoded based on the field's type:
+
+- str: number of distinct values (varint), each distinct value (varint length and UTF-8 bytes), then
+  for each row the index of its value plus one, or 0 if missing (varint)
+- int: bitmap of which rows have a value, then each value (zigzag varint)
+- float: bitmap of which rows have a value, width of values (4 or 8), then each value (little endian
+  IEEE 754). Values are stored as 32 bit floats unless they are outside of the 32 bit range.
+- bool: bitmap of which rows have a value, then a bitmap of values
+
+Bitmaps are stored least significant bit first, padded to a whole number of bytes.
+"""
+
+import math
+import struct
+
+MAGIC = b"ERBV"
+
+VERSION = 1
+
+# Types of the fields of variants in the combined table, other than info and group_results
+VARIANT_FIELD_TYPES = {
+    "variant_id": "str",
+    "pos": "int",
+    "consequence": "str",
+    "hgvsc": "str",
+    "hgvsp": "str",
+}
+
+FLOAT32_MIN = 1e-37
+
+FLOAT32_MAX = 3e38
+
+
+def _write_varint(buffer, value):
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _write_bitmap(buffer, flags):
+    bitmap = bytearray((len(flags) + 7) // 8)
+    for i, flag in enumerate(flags):
+        if flag:
+            bitmap[i // 8] |= 1 << (i % 8)
+    buffer.extend(bitmap)
+
+
+def _is_float32_compatible(value):
+    return not math.isfinite(value) or value == 0 or FLOAT32_MIN <= abs(value) <= FLOAT32_MAX
+
+
+def _encode_column(buffer, typ, values):
+    if typ == "str":
+        indices = {}
+        for value in values:
+            if value is not None and value not in indices:
+                indices[value] = len(indices)
+        _write_varint(buffer, len(indices))
+        for value in indices:
+            encoded_value = value.encode("utf-8")
+            _write_varint(buffer, len(encoded_value))
+            buffer.extend(encoded_value)
+        for value in values:
+            _write_varint(buffer, 0 if value is None else indices[value] + 1)
+        return
+
+    _write_bitmap(buffer, [value is not None for value in values])
+    values = [value for value in values if value is not None]
+
+    if typ == "int":
+        for value in values:
+            _write_varint(buffer, (value << 1) ^ (value >> 63))
+    elif typ == "float":
+        # JSON encoding of the combined table represents non-finite floats as strings
+        values = [float(value) for value in values]
+        width = 4 if all(_is_float32_compatible(value) for value in values) else 8
+        buffer.append(width)
+        buffer.extend(struct.pack(f"<{len(values)}{'f' if width == 4 else 'd'}", *values))
+    elif typ == "bool":
+        _write_bitmap(buffer, values)
+    else:
+        raise ValueError(f"Unsupported field type '{typ}'")
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def read_bytes(self, n):
+        value = self.data[self.offset : self.offset + n]
+        self.offset += n
+        return value
+
+    def read_varint(self):
+        value = 0
+        shift = 0
+        while True:
+            byte = self.data[self.offset]
+            self.offset += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def read_bitmap(self, n):
+        bitmap = self.read_bytes((n + 7) // 8)
+        return [bool(bitmap[i // 8] & (1 << (i % 8))) for i in range(n)]
+
+
+def _decode_column(reader, typ, n):
+    if typ == "str":
+        distinct_values = [reader.read_bytes(reader.read_varint()).decode("utf-8") for _ in range(reader.read_varint())]
+        indices = [reader.read_varint() for _ in range(n)]
+        return [None if index == 0 else distinct_values[index - 1] for index in indices]
+
+    is_present = reader.read_bitmap(n)
+    n_present = sum(is_present)
+
+    if typ == "int":
+        values = []
+        for _ in range(n_present):
+            value = reader.read_varint()
+            values.append((value >> 1) ^ -(value & 1))
+    elif typ == "float":
+        width = reader.read_bytes(1)[0]
+        values = struct.unpack(f"<{n_present}{'f' if width == 4 else 'd'}", reader.read_bytes(width * n_present))
+    elif typ == "bool":
+        values = reader.read_bitmap(n_present)
+    else:
+        raise ValueError(f"Unsupported field type '{typ}'")
+
+    values = iter(values)
+    return [next(values) if present else None for present in is_present]
+
+
+def encode_variants(variants, variant_fields, dataset_metadata):
+    """
+    Encode a list of variants (in the format of the combined table's variants field) for a dataset.
+    """
+    buffer = bytearray(MAGIC)
+    buffer.append(VERSION)
+    _write_varint(buffer, len(variants))
+
+    for field_index, field in enumerate(variant_fields):
+        if field == "info":
+            for i, typ in enumerate(dataset_metadata["variant_info_field_types"]):
+                _encode_column(
+                    buffer,
+                    typ,
+                    [None if variant[field_index] is None else variant[field_index][i] for variant in variants],
+                )
+        elif field == "group_results":
+            for group_index, _ in enumerate(dataset_metadata["variant_result_analysis_groups"]):
+                group_results = [variant[field_index][group_index] for variant in variants]
+                _write_bitmap(buffer, [result is not None for result in group_results])
+                group_results = [result for result in group_results if result is not None]
+                for i, typ in enumerate(dataset_metadata["variant_group_result_field_types"]):
+                    _encode_column(buffer, typ, [result[i] for result in group_results])
+        else:
+            _encode_column(buffer, VARIANT_FIELD_TYPES[field], [variant[field_index] for variant in variants])
+
+    return bytes(buffer)
+
+
+def decode_variants(data, variant_fields, dataset_metadata):
+    """
+    Decode a list of variants encoded by `encode_variants`.
+    """
+    reader = _Reader(data)
+    if reader.read_bytes(len(MAGIC)) != MAGIC:
+        raise ValueError("Not an encoded variants list")
+
+    version = reader.read_bytes(1)[0]
+    if version != VERSION:
+        raise ValueError(f"Unsupported version {version}")
+
+    n_variants = reader.read_varint()
+    columns = []
+    for field in variant_fields:
+        if field == "info":
+            info_columns = [
+                _decode_column(reader, typ, n_variants) for typ in dataset_metadata["variant_info_field_types"]
+            ]
+            columns.append([list(info) for info in zip(*info_columns)] or [[] for _ in range(n_variants)])
+        elif field == "group_results":
+            group_columns = []
+            for _ in dataset_metadata["variant_result_analysis_groups"]:
+                has_result = reader.read_bitmap(n_variants)
+                n_results = sum(has_result)
+                result_columns = [
+                    _decode_column(reader, typ, n_results)
+                    for typ in dataset_metadata["variant_group_result_field_types"]
+                ]
+                results = iter([list(result) for result in zip(*result_columns)] or [[] for _ in range(n_results)])
+                group_columns.append([next(results) if present else None for present in has_result])
+            columns.append(
+                [list(group_results) for group_results in zip(*group_columns)] or [[] for _ in range(n_variants)]
+            )
+        else:
+            columns.append(_decode_column(reader, VARIANT_FIELD_TYPES[field], n_variants))
+
+    return [list(variant) for variant in zip(*columns)] if columns else []
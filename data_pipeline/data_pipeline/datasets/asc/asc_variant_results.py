@@ -1,6 +1,9 @@
 import hail as hl
 
 from data_pipeline.config import pipeline_config
+from data_pipeline.imports import import_variant_table
+from data_pipeline.joins import join_variant_results
+from data_pipeline.partitioning import get_n_partitions
 
 
 CONSEQUENCE_TERMS = [
@@ -57,10 +60,11 @@ def prepare_variant_results():
         group_annotations_path = pipeline_config.get("ASC", f"{group}_variant_annotations_path")
         group_results_path = pipeline_config.get("ASC", f"{group}_variant_results_path")
 
-        group_annotations = hl.import_table(
+        group_annotations = import_variant_table(
             group_annotations_path,
+            "v",
+            "GRCh37",
             force=True,
-            key="v",
             missing="NA",
             types={
                 "v": hl.tstr,
@@ -77,18 +81,20 @@ def prepare_variant_results():
             },
         )
 
-        group_annotations = group_annotations.repartition(100, shuffle=True)
+        group_annotations = group_annotations.repartition(get_n_partitions(group_annotations_path), shuffle=True)
 
         if annotations is None:
             annotations = group_annotations
         else:
             annotations = annotations.union(group_annotations)
 
-        group_results = hl.import_table(
+        group_results_n_partitions = get_n_partitions(group_results_path)
+        group_results = import_variant_table(
             group_results_path,
+            "v",
+            "GRCh37",
             force=True,
-            min_partitions=100,
-            key="v",
+            min_partitions=group_results_n_partitions,
             missing="NA",
             types={
                 "v": hl.tstr,
@@ -102,35 +108,18 @@ def prepare_variant_results():
             },
         )
 
-        group_results = group_results.repartition(100, shuffle=True)
+        group_results = group_results.repartition(group_results_n_partitions, shuffle=True)
 
         group_results = group_results.drop("af_case", "af_ctrl")
 
-        group_results = group_results.annotate(in_analysis=group_annotations[group_results.v].in_analysis)
+        group_results = group_results.annotate(in_analysis=group_annotations[group_results.key].in_analysis)
 
         if results is None:
             results = group_results
         else:
             results = results.union(group_results)
 
-    annotations = annotations.cache()
-    results = results.cache()
-
-    annotations = annotations.distinct()
-    annotations = annotations.cache()
-
-    annotations = annotations.select(
-        "gene_id",
-        consequence=hl.sorted(
-            annotations.csq_analysis.split(","),
-            lambda c: CONSEQUENCE_TERM_RANKS.get(c),  # pylint: disable=unnecessary-lambda
-        )[0],
-        hgvsc=annotations.hgvsc.split(":")[-1],
-        hgvsp=annotations.hgvsp.split(":")[-1],
-        info=hl.struct(mpc=annotations.mpc, polyphen=annotations.polyphen),
-    )
-
-    results = results.group_by("v").aggregate(group_results=hl.agg.collect(results.row_value))
+    results = results.group_by("locus", "alleles").aggregate(group_results=hl.agg.collect(results.row_value))
     results = results.annotate(
         group_results=hl.dict(
             results.group_results.map(
@@ -138,14 +127,22 @@ def prepare_variant_results():
             )
         )
     )
+    results = results.cache()
 
-    variants = annotations.annotate(group_results=results[annotations.key].group_results)
+    # Variants may be annotated in more than one group's annotations
+    variants = join_variant_results(annotations, results, "ASC")
+    variants = variants.distinct()
 
-    variants = variants.annotate(
-        locus=hl.rbind(variants.v.split(":"), lambda p: hl.locus(p[0], hl.int(p[1]), reference_genome="GRCh37")),
-        alleles=hl.rbind(variants.v.split(":"), lambda p: [p[2], p[3]]),
+    variants = variants.select(
+        "gene_id",
+        consequence=hl.sorted(
+            variants.csq_analysis.split(","),
+            lambda c: CONSEQUENCE_TERM_RANKS.get(c),  # pylint: disable=unnecessary-lambda
+        )[0],
+        hgvsc=variants.hgvsc.split(":")[-1],
+        hgvsp=variants.hgvsp.split(":")[-1],
+        info=hl.struct(mpc=variants.mpc, polyphen=variants.polyphen),
+        group_results=variants.group_results,
     )
 
-    variants = variants.key_by("locus", "alleles")
-
     return variants
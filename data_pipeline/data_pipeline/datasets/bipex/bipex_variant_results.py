@@ -1,14 +1,12 @@
 import hail as hl
 
 from data_pipeline.config import pipeline_config
+from data_pipeline.joins import join_variant_results
 
 
 def prepare_variant_results():
     results = hl.read_table(pipeline_config.get("BipEx", "variant_results_path"))
 
-    # Get unique variants from results table
-    variants = results.group_by(results.locus, results.alleles).aggregate()
-
     # Select AC/AF numbers for the alternate allele
     results = results.annotate(ac_case=results.ac_case[1], ac_ctrl=results.ac_ctrl[1])
 
@@ -26,20 +24,23 @@ def prepare_variant_results():
         )
     )
 
-    variants = variants.annotate(**results[variants.locus, variants.alleles])
-
     # Merge variant annotations for canonical transcripts
     annotations = hl.read_table(pipeline_config.get("BipEx", "variant_annotations_path"))
     annotations = annotations.filter(annotations.transcript_id == annotations.canonical_transcript_id)
 
-    annotations = annotations.select(
+    variants = join_variant_results(annotations, results, "BipEx")
+
+    # A variant may have annotations for more than one canonical transcript (for example, in overlapping genes).
+    # Keep one annotation for each variant.
+    variants = variants.distinct()
+
+    variants = variants.select(
         "gene_id",
-        consequence=annotations.csq_analysis,
-        hgvsc=annotations.hgvsc_canonical.split(":")[-1],
-        hgvsp=annotations.hgvsp_canonical.split(":")[-1],
-        info=hl.struct(cadd=annotations.cadd, mpc=annotations.mpc, polyphen=annotations.polyphen),
+        consequence=variants.csq_analysis,
+        hgvsc=variants.hgvsc_canonical.split(":")[-1],
+        hgvsp=variants.hgvsp_canonical.split(":")[-1],
+        info=hl.struct(cadd=variants.cadd, mpc=variants.mpc, polyphen=variants.polyphen),
+        group_results=variants.group_results,
     )
 
-    variants = variants.annotate(**annotations[variants.locus, variants.alleles])
-
     return variants
@@ -1,14 +1,19 @@
 import hail as hl
 
 from data_pipeline.config import pipeline_config
+from data_pipeline.imports import import_variant_table
+from data_pipeline.joins import join_variant_results
+from data_pipeline.partitioning import get_n_partitions
 
 
 def prepare_variant_results():
-    variant_results = hl.import_table(
-        pipeline_config.get("Epi25", "variant_results_path"),
+    variant_results_path = pipeline_config.get("Epi25", "variant_results_path")
+    variant_results = import_variant_table(
+        variant_results_path,
+        "Variant ID",
+        "GRCh37",
         force_bgz=True,
-        min_partitions=100,
-        key="Variant ID",
+        min_partitions=get_n_partitions(variant_results_path),
         missing="NA",
         types={
             "Variant ID": hl.tstr,
@@ -47,7 +52,7 @@ def prepare_variant_results():
 
     variant_results = variant_results.drop("af_case", "af_ctrl")
 
-    variant_results = variant_results.group_by("Variant ID").aggregate(
+    variant_results = variant_results.group_by("locus", "alleles").aggregate(
         group_results=hl.agg.collect(variant_results.row_value)
     )
     variant_results = variant_results.annotate(
@@ -58,11 +63,13 @@ def prepare_variant_results():
         )
     )
 
-    variant_annotations = hl.import_table(
-        pipeline_config.get("Epi25", "variant_annotations_path"),
+    variant_annotations_path = pipeline_config.get("Epi25", "variant_annotations_path")
+    variant_annotations = import_variant_table(
+        variant_annotations_path,
+        "Variant ID",
+        "GRCh37",
         force_bgz=True,
-        min_partitions=100,
-        key="Variant ID",
+        min_partitions=get_n_partitions(variant_annotations_path),
         missing="NA",
         types={
             "Variant ID": hl.tstr,
@@ -110,29 +117,21 @@ def prepare_variant_results():
         }
     )
 
-    variant_annotations = variant_annotations.select(
+    variants = join_variant_results(variant_annotations, variant_results, "Epi25")
+
+    variants = variants.select(
         "gene_id",
-        consequence=variant_annotations.csq_analysis,
-        hgvsc=variant_annotations.hgvsc_canonical.split(":")[-1],
-        hgvsp=variant_annotations.hgvsp_canonical.split(":")[-1],
+        consequence=variants.csq_analysis,
+        hgvsc=variants.hgvsc_canonical.split(":")[-1],
+        hgvsp=variants.hgvsp_canonical.split(":")[-1],
         info=hl.struct(
-            comment=variant_annotations.comment,
-            in_analysis=variant_annotations.in_analysis,
-            cadd=variant_annotations.cadd,
-            mpc=variant_annotations.mpc,
-            polyphen=variant_annotations.polyphen,
-        ),
-    )
-
-    variants = variant_annotations.annotate(group_results=variant_results[variant_annotations.key].group_results)
-
-    variants = variants.annotate(
-        locus=hl.rbind(
-            variants["Variant ID"].split(":"), lambda p: hl.locus(p[0], hl.int(p[1]), reference_genome="GRCh37")
+            comment=variants.comment,
+            in_analysis=variants.in_analysis,
+            cadd=variants.cadd,
+            mpc=variants.mpc,
+            polyphen=variants.polyphen,
         ),
-        alleles=hl.rbind(variants["Variant ID"].split(":"), lambda p: [p[2], p[3]]),
+        group_results=variants.group_results,
     )
 
-    variants = variants.key_by("locus", "alleles")
-
     return variants
@@ -1,6 +1,7 @@
 import hail as hl
 
 from data_pipeline.config import pipeline_config
+from data_pipeline.joins import join_variant_results
 
 
 def prepare_variant_results():
@@ -26,6 +27,7 @@ def prepare_variant_results():
     )
 
     variants = hl.read_table(annotations_path)
+    variants = join_variant_results(variants, results, "SCHEMA")
     variants = variants.select(
         gene_id=variants.gene_id,
         consequence=hl.case()
@@ -36,9 +38,7 @@ def prepare_variant_results():
         hgvsc=variants.hgvsc_canonical.split(":")[-1],
         hgvsp=variants.hgvsp_canonical.split(":")[-1],
         info=hl.struct(cadd=variants.cadd, mpc=variants.mpc, polyphen=variants.polyphen),
+        group_results=variants.group_results,
     )
 
-    variants = variants.annotate(**results[variants.key])
-    variants = variants.filter(hl.is_defined(variants.group_results))
-
     return variants
@@ -0,0 +1,32 @@
+import hail as hl
+
+
+def parse_variant_id(variant_id, reference_genome):
+    """
+    Parse a `chrom:pos:ref:alt` variant ID expression into a struct with locus and alleles.
+    """
+    return hl.rbind(
+        variant_id.split(":"),
+        lambda parts: hl.struct(
+            locus=hl.locus(parts[0], hl.int(parts[1]), reference_genome=reference_genome),
+            alleles=[parts[2], parts[3]],
+        ),
+    )
+
+
+def import_variant_table(path, variant_id_field, reference_genome, **kwargs):
+    """
+    Import a table of variants identified by `chrom:pos:ref:alt` strings in `variant_id_field`, keyed by
+    locus and alleles.
+
+    Variant IDs are parsed as soon as the table is imported, so that later joins and aggregations use
+    the same key as the final table and it does not have to be keyed again. Other arguments are passed
+    to `hl.import_table`.
+    """
+    assert "key" not in kwargs, "Tables of variants are keyed by locus and alleles"
+
+    ds = hl.import_table(path, **kwargs)
+    ds = ds.key_by(**parse_variant_id(ds[variant_id_field], reference_genome))
+    ds = ds.drop(variant_id_field)
+
+    return ds
@@ -0,0 +1,82 @@
+import hail as hl
+
+from data_pipeline.config import pipeline_config
+from data_pipeline.metrics import get_step, step
+
+
+def get_lookup(ds, name=None, max_rows=None):
+    """
+    Get a function that looks up rows of a table keyed by a single field, like `ds[key]`.
+
+    If the table has at most `max_rows` rows (configured by the `broadcast_max_rows` option in the
+    `partitioning` section of pipeline_config.ini), it is collected and lookups use a literal dict,
+    which is broadcast to workers instead of joining tables. Otherwise, lookups join with the table.
+    """
+    assert len(ds.key) == 1, "Lookup table must be keyed by a single field"
+
+    if max_rows is None:
+        max_rows = pipeline_config.getint("partitioning", "broadcast_max_rows", fallback=100_000)
+
+    key_field = list(ds.key)[0]
+
+    # Count at most one more than the maximum number of rows, so that large tables are neither read in full nor
+    # collected. For tables read from disk, this uses the row counts stored with the table.
+    n_rows = ds.head(max_rows + 1).count()
+    if n_rows > max_rows:
+        print(f"Joining with {name or 'table'} (more than {max_rows} rows)")
+        return lambda key: ds[key]
+
+    rows = ds.aggregate(hl.agg.collect(hl.tuple([ds[key_field], ds.row_value])))
+    print(f"Using literal lookup for {name or 'table'} ({n_rows} rows)")
+    lookup = hl.literal(dict(rows), hl.tdict(ds[key_field].dtype, ds.row_value.dtype))
+    return lookup.get
+
+
+def join_variant_results(annotations, results, dataset_id):
+    """
+    Join variant annotations with variant results, keeping only variants that have results.
+
+    Use this before computing annotation fields or deduplicating annotations, so that work is only done
+    for variants that are kept. Both tables must be keyed by the same fields. All of the results table's
+    row fields are added to the annotations.
+
+    If the `count_annotated_variants` option in the `output` section of pipeline_config.ini is enabled, the
+    number of annotated variants is recorded in a `{dataset}.variant_results.annotations` step, so that it can
+    be compared to the number of variants written (see `print_variant_join_summary`). Counting requires
+    reading the annotations table, so annotations are cached to avoid reading them again for the join.
+    """
+    assert list(annotations.key.dtype.types) == list(
+        results.key.dtype.types
+    ), "Annotations and results must be keyed by the same types"
+
+    if pipeline_config.getboolean("output", "count_annotated_variants", fallback=False):
+        annotations = annotations.cache()
+        with step(f"{dataset_id.lower()}.variant_results.annotations") as record:
+            record["annotations_rows"] = annotations.count()
+
+        print(f"{dataset_id}: {record['annotations_rows']} annotated variants")
+
+    return annotations.join(results, how="inner")
+
+
+def print_variant_join_summary(dataset_id):
+    """
+    Print the number of a dataset's variants that have results and the time taken to prepare and write its
+    variant results, based on the steps recorded in the current metrics report. If annotated variants were
+    counted (see `join_variant_results`), also print the fraction of them that have results.
+    """
+    annotations_step = get_step(f"{dataset_id.lower()}.variant_results.annotations")
+    write_step = get_step(f"{dataset_id.lower()}.variant_results.write")
+    if not write_step or "output_rows" not in write_step:
+        return
+
+    n_variants = write_step["output_rows"]
+    if annotations_step:
+        n_annotations = annotations_step["annotations_rows"]
+        summary = f"{n_variants} of {n_annotations} annotated variants have results" + (
+            f" ({n_variants / n_annotations:.1%})" if n_annotations else ""
+        )
+    else:
+        summary = f"{n_variants} variants have results"
+
+    print(f"{dataset_id}: {summary}, variant results written in {write_step['wall_time_s']:.1f}s")
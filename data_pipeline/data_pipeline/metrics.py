@@ -0,0 +1,201 @@
+"""
+Machine readable execution metrics for pipeline steps.
+
+Pipelines record metrics by running inside `pipeline_metrics` and wrapping each Hail action (write,
+aggregate, collect, ...) in `step`. Each step's Spark jobs are tagged with a job group so that their
+metrics can be looked up with Spark's monitoring REST API when the step finishes.
+
+Reports are written to `{metrics_path}/{pipeline}/{start time}.json`, where `metrics_path` is configured
+in the `output` section of pipeline_config.ini (defaults to `{staging_path}/metrics`). A new report is
+written for each run so that runs can be compared.
+"""
+
+import contextlib
+import datetime
+import json
+import statistics
+import time
+import urllib.request
+
+import hail as hl
+
+from data_pipeline.config import pipeline_config
+
+
+STAGE_METRICS = [
+    "numTasks",
+    "executorRunTime",
+    "inputBytes",
+    "inputRecords",
+    "outputBytes",
+    "outputRecords",
+    "shuffleReadBytes",
+    "shuffleReadRecords",
+    "shuffleWriteBytes",
+    "shuffleWriteRecords",
+    "memoryBytesSpilled",
+    "diskBytesSpilled",
+    "peakExecutionMemory",
+]
+
+# Reports for pipelines that are currently recording metrics. Steps are recorded in the last one.
+_reports = []
+
+
+def get_metrics_path():
+    return pipeline_config.get(
+        "output", "metrics_path", fallback=f"{pipeline_config.get('output', 'staging_path')}/metrics"
+    )
+
+
+def _get_spark_api(spark_context, endpoint):
+    url = f"{spark_context.uiWebUrl}/api/v1/applications/{spark_context.applicationId}/{endpoint}"
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return json.load(response)
+
+
+def get_spark_metrics(spark_context, job_group):
+    """
+    Get metrics for all Spark stages run by jobs in a job group and peak memory used by executors.
+    """
+    jobs = [job for job in _get_spark_api(spark_context, "jobs") if job.get("jobGroup") == job_group]
+
+    stages = []
+    for stage_id in sorted({stage_id for job in jobs for stage_id in job["stageIds"]}):
+        for attempt in _get_spark_api(spark_context, f"stages/{stage_id}"):
+            if attempt["status"] == "SKIPPED":
+                continue
+            stages.append(
+                {
+                    "stage_id": stage_id,
+                    "attempt_id": attempt["attemptId"],
+                    "name": attempt["name"],
+                    **{metric: attempt.get(metric) for metric in STAGE_METRICS},
+                }
+            )
+
+    totals = {
+        metric: sum(stage[metric] or 0 for stage in stages)
+        for metric in STAGE_METRICS
+        if metric != "peakExecutionMemory"
+    }
+
+    # Executor peak memory metrics are cumulative over the application
+    executors = _get_spark_api(spark_context, "allexecutors")
+    peak_memory = [
+        executor["peakMemoryMetrics"].get("JVMHeapMemory", 0)
+        for executor in executors
+        if executor.get("peakMemoryMetrics")
+    ]
+
+    return {
+        "n_jobs": len(jobs),
+        "stages": stages,
+        "totals": totals,
+        "peak_executor_jvm_heap_bytes": max(peak_memory) if peak_memory else None,
+    }
+
+
+def get_table_metrics(path):
+    """
+    Get number of rows and partition sizes of a Hail table written to `path`.
+    """
+    ds = hl.read_table(path)
+    partition_sizes = [entry["size_bytes"] for entry in hl.hadoop_ls(f"{path}/rows/parts")]
+
+    return {
+        "output_path": path,
+        # Partition counts are stored in the table's metadata, so this does not scan the table
+        "output_rows": ds.count(),
+        "output_partitions": ds.n_partitions(),
+        "output_bytes": sum(partition_sizes),
+        "partition_bytes": {
+            "min": min(partition_sizes),
+            "median": statistics.median(partition_sizes),
+            "max": max(partition_sizes),
+        }
+        if partition_sizes
+        else None,
+    }
+
+
+@contextlib.contextmanager
+def pipeline_metrics(pipeline):
+    """
+    Record metrics for steps run in this context and write a report when it exits.
+    """
+    start_time = datetime.datetime.utcnow()
+    report = {"pipeline": pipeline, "start_time": start_time.isoformat() + "Z", "status": "running", "steps": []}
+    _reports.append(report)
+
+    try:
+        yield
+        report["status"] = "succeeded"
+    except BaseException:
+        report["status"] = "failed"
+        raise
+    finally:
+        _reports.remove(report)
+        report["wall_time_s"] = (datetime.datetime.utcnow() - start_time).total_seconds()
+        report_path = f"{get_metrics_path()}/{pipeline}/{start_time.strftime('%Y%m%dT%H%M%SZ')}.json"
+        with hl.hadoop_open(report_path, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f"Wrote metrics report to {report_path}")
+
+
+def get_step(tag):
+    """
+    Get the record of the last step with a tag in the current report, or None if there is no such step
+    or metrics are not being recorded.
+    """
+    if not _reports:
+        return None
+
+    for record in reversed(_reports[-1]["steps"]):
+        if record["tag"] == tag:
+            return record
+
+    return None
+
+
+@contextlib.contextmanager
+def step(tag, output_path=None):
+    """
+    Record metrics for the Hail actions run in this context, identified by `tag` (for example,
+    `asc.variant_results.write`). If the step writes a Hail table, pass its path as `output_path`
+    to record the number of rows and size of partitions in the output.
+
+    Yields the step's record, so that other details about the step can be added to the report.
+
+    Steps are identified by setting the Spark job group, which applies to all threads unless PySpark's
+    pinned thread mode is enabled, so steps must not be run concurrently.
+    """
+    if not _reports:
+        yield {}
+        return
+
+    report = _reports[-1]
+
+    spark_context = hl.spark_context()
+    spark_context.setJobGroup(tag, tag)
+
+    record = {"tag": tag}
+    start_time = time.time()
+    try:
+        yield record
+    finally:
+        record["wall_time_s"] = time.time() - start_time
+        spark_context.setLocalProperty("spark.jobGroup.id", None)
+        spark_context.setLocalProperty("spark.job.description", None)
+        report["steps"].append(record)
+
+    if spark_context.uiWebUrl:
+        try:
+            record.update(get_spark_metrics(spark_context, tag))
+        except (OSError, ValueError) as error:
+            record["spark_metrics_error"] = str(error)
+
+    if output_path:
+        record.update(get_table_metrics(output_path))
+
+    print(f"{tag}: {record['wall_time_s']:.1f}s")
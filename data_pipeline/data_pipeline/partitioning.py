@@ -0,0 +1,35 @@
+import math
+
+import hail as hl
+
+from data_pipeline.config import pipeline_config
+
+
+def get_input_size(path):
+    """
+    Get the total size in bytes of a file or all files in a directory.
+    """
+    return sum(entry["size_bytes"] for entry in hl.hadoop_ls(path) if not entry["is_dir"])
+
+
+def get_n_partitions(path):
+    """
+    Choose a number of partitions for importing a file based on its size.
+
+    The estimated uncompressed size of the file is divided by the target partition size configured
+    in the `partitioning` section of pipeline_config.ini and bounded by the configured minimum and
+    maximum number of partitions.
+    """
+    target_partition_size = pipeline_config.getfloat("partitioning", "target_partition_size_mb", fallback=128) * 2 ** 20
+    compression_ratio = pipeline_config.getfloat("partitioning", "compression_ratio", fallback=5)
+    min_partitions = pipeline_config.getint("partitioning", "min_partitions", fallback=1)
+    max_partitions = pipeline_config.getint("partitioning", "max_partitions", fallback=1000)
+
+    input_size = get_input_size(path)
+    estimated_size = input_size * compression_ratio if path.endswith((".gz", ".bgz")) else input_size
+
+    n_partitions = min(max(math.ceil(estimated_size / target_partition_size), min_partitions), max_partitions)
+
+    print(f"Using {n_partitions} partitions for {path} ({input_size} bytes, ~{int(estimated_size)} bytes uncompressed)")
+
+    return n_partitions
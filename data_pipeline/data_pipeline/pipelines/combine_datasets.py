@@ -5,6 +5,7 @@ import sys
 import hail as hl
 
 from data_pipeline.config import pipeline_config
+from data_pipeline.metrics import pipeline_metrics, step
 
 
 VARIANT_FIELDS = [
@@ -18,11 +19,41 @@ VARIANT_FIELDS = [
 ]
 
 
+def get_variant_counts(variant_results, analysis_groups, group_result_field_names):
+    """
+    Aggregate counts of variants in a gene used for variant filter controls.
+
+    Variant counts for analysis groups are listed in the same order as the analysis groups.
+    """
+    group_results = variant_results.group_results
+
+    def _count_group_variants(group_index):
+        group_result = group_results[group_index]
+        counts = {"n_variants": hl.agg.count_where(hl.is_defined(group_result))}
+        if "ac_case" in group_result_field_names:
+            counts["n_case_variants"] = hl.agg.count_where(group_result[group_result_field_names.index("ac_case")] > 0)
+        if "ac_ctrl" in group_result_field_names:
+            counts["n_control_variants"] = hl.agg.count_where(
+                group_result[group_result_field_names.index("ac_ctrl")] > 0
+            )
+        return hl.struct(**counts)
+
+    return hl.struct(
+        n_variants=hl.agg.count(),
+        consequence=hl.sorted(
+            hl.agg.filter(
+                hl.is_defined(variant_results.consequence), hl.agg.counter(variant_results.consequence)
+            ).items()
+        ),
+        analysis_groups=[_count_group_variants(i) for i in range(len(analysis_groups))],
+    )
+
+
 def combine_datasets(dataset_ids):
     gene_models_path = f"{pipeline_config.get('output', 'staging_path')}/gene_models.ht"
     ds = hl.read_table(gene_models_path)
 
-    ds = ds.annotate(gene_results=hl.struct(), variants=hl.struct())
+    ds = ds.annotate(gene_results=hl.struct(), variant_counts=hl.struct(), variants=hl.struct())
     ds = ds.annotate_globals(meta=hl.struct(variant_fields=VARIANT_FIELDS, datasets=hl.struct()))
 
     for dataset_id in dataset_ids:
@@ -33,9 +64,10 @@ def combine_datasets(dataset_ids):
         gene_group_result_field_types = [
             str(typ).rstrip("3264") for typ in gene_results.group_results.dtype.value_type.types
         ]
-        gene_result_analysis_groups = list(
-            gene_results.aggregate(hl.agg.explode(hl.agg.collect_as_set, gene_results.group_results.keys()))
-        )
+        with step(f"{dataset_id.lower()}.gene_results.analysis_groups"):
+            gene_result_analysis_groups = list(
+                gene_results.aggregate(hl.agg.explode(hl.agg.collect_as_set, gene_results.group_results.keys()))
+            )
 
         gene_results = gene_results.annotate(
             group_results=hl.array(
@@ -57,9 +89,10 @@ def combine_datasets(dataset_ids):
         variant_group_result_field_types = [
             str(typ).rstrip("3264") for typ in variant_results.group_results.dtype.value_type.types
         ]
-        variant_result_analysis_groups = list(
-            variant_results.aggregate(hl.agg.explode(hl.agg.collect_as_set, variant_results.group_results.keys()))
-        )
+        with step(f"{dataset_id.lower()}.variant_results.analysis_groups"):
+            variant_result_analysis_groups = list(
+                variant_results.aggregate(hl.agg.explode(hl.agg.collect_as_set, variant_results.group_results.keys()))
+            )
 
         variant_results = variant_results.annotate(
             info=hl.tuple([variant_results.info[field] for field in variant_info_field_names]),
@@ -92,17 +125,23 @@ def combine_datasets(dataset_ids):
             variant=hl.tuple([variant_results[field] for field in VARIANT_FIELDS])
         )
         variant_results = variant_results.group_by("gene_id").aggregate(
-            variants=hl.agg.collect(variant_results.variant)
+            variants=hl.agg.collect(variant_results.variant),
+            variant_counts=get_variant_counts(
+                variant_results, variant_result_analysis_groups, variant_group_result_field_names
+            ),
         )
+        # Use one join for both fields, so that variants are grouped by gene only once
+        dataset_variants = variant_results[ds.gene_id]
         ds = ds.annotate(
+            variant_counts=ds.variant_counts.annotate(**{dataset_id: dataset_variants.variant_counts}),
             variants=ds.variants.annotate(
                 **{
                     dataset_id: hl.or_else(
-                        variant_results[ds.gene_id].variants,
+                        dataset_variants.variants,
                         hl.empty_array(variant_results.variants.dtype.element_type),
                     )
                 }
-            )
+            ),
         )
 
         ds = ds.annotate_globals(
@@ -149,7 +188,10 @@ def main():
     hl.init()
 
     output_path = os.path.join(pipeline_config.get("output", "staging_path"), "combined.ht")
-    combine_datasets(datasets_to_combine).write(output_path, overwrite=True)
+    with pipeline_metrics("combine_datasets"):
+        combined = combine_datasets(datasets_to_combine)
+        with step("combined.write", output_path=output_path):
+            combined.write(output_path, overwrite=True)
 
 
 if __name__ == "__main__":
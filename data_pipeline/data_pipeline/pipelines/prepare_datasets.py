@@ -6,7 +6,54 @@ import sys
 import hail as hl
 
 from data_pipeline.config import pipeline_config
-from data_pipeline.validation import validate_gene_results_table, validate_variant_results_table
+from data_pipeline.joins import print_variant_join_summary
+from data_pipeline.metrics import pipeline_metrics, step
+from data_pipeline.validation import (
+    check_table_profile,
+    print_table_profile,
+    profile_table,
+    sample_partitions,
+    validate_gene_results_table,
+    validate_variant_results_table,
+)
+
+
+def get_gene_model_ids():
+    gene_models_path = f"{pipeline_config.get('output', 'staging_path')}/gene_models.ht"
+    if not hl.hadoop_exists(gene_models_path):
+        print("Gene models have not been prepared, skipping check for genes missing from gene models")
+        return None
+
+    return set(hl.read_table(gene_models_path).gene_id.collect())
+
+
+def profile_dataset(dataset_id, gene_model_ids=None, sample=None):
+    """
+    Profile and check a dataset's written gene and variant results tables.
+
+    Profiling reads the written tables, so that it does not repeat the work done to prepare them. If
+    `sample` is given, only that fraction of each table's partitions is read.
+    """
+    output_path = pipeline_config.get("output", "staging_path")
+
+    for table_name in ("gene_results", "variant_results"):
+        table_path = os.path.join(output_path, dataset_id.lower(), f"{table_name}.ht")
+        if not hl.hadoop_exists(table_path):
+            raise Exception(f"{table_path} does not exist, run prepare_datasets without --sample to write it")
+
+        ds = hl.read_table(table_path)
+        if sample:
+            ds = sample_partitions(ds, sample)
+
+        tag = f"{dataset_id.lower()}.{table_name}"
+        with step(f"{tag}.profile") as record:
+            profile = profile_table(ds, gene_model_ids)
+            record["profile"] = profile
+
+        print(f"{tag}:")
+        print_table_profile(profile)
+        # A variant may have results for more than one gene
+        check_table_profile(profile, unique_key=table_name == "gene_results")
 
 
 def prepare_dataset(dataset_id):
@@ -19,21 +66,39 @@ def prepare_dataset(dataset_id):
         f"data_pipeline.datasets.{dataset_id.lower()}.{dataset_id.lower()}_variant_results"
     )
 
-    gene_results = gene_results_module.prepare_gene_results()
+    with step(f"{dataset_id.lower()}.gene_results.prepare"):
+        gene_results = gene_results_module.prepare_gene_results()
     validate_gene_results_table(gene_results)
-    gene_results.write(os.path.join(output_path, dataset_id.lower(), "gene_results.ht"), overwrite=True)
+    gene_results_path = os.path.join(output_path, dataset_id.lower(), "gene_results.ht")
+    with step(f"{dataset_id.lower()}.gene_results.write", output_path=gene_results_path):
+        gene_results.write(gene_results_path, overwrite=True)
 
-    variant_results = variant_results_module.prepare_variant_results()
+    with step(f"{dataset_id.lower()}.variant_results.prepare"):
+        variant_results = variant_results_module.prepare_variant_results()
     validate_variant_results_table(variant_results)
-    variant_results.write(os.path.join(output_path, dataset_id.lower(), "variant_results.ht"), overwrite=True)
+    variant_results_path = os.path.join(output_path, dataset_id.lower(), "variant_results.ht")
+    with step(f"{dataset_id.lower()}.variant_results.write", output_path=variant_results_path):
+        variant_results.write(variant_results_path, overwrite=True)
+    print_variant_join_summary(dataset_id)
 
 
 def main():
     all_datasets = pipeline_config.get("datasets", "datasets").split(",")
     parser = argparse.ArgumentParser()
     parser.add_argument("datasets", nargs="*", metavar=f"{{{','.join(all_datasets)}}}")
+    parser.add_argument(
+        "--sample",
+        type=float,
+        metavar="FRACTION",
+        help="Check a fraction of the partitions of previously prepared tables without preparing them again "
+        "(for example, 0.01)",
+    )
     args = parser.parse_args()
 
+    if args.sample is not None and not 0 < args.sample <= 1:
+        print("error: --sample must be greater than 0 and at most 1", file=sys.stderr)
+        return 1
+
     if args.datasets:
         for dataset in args.datasets:
             if dataset not in all_datasets:
@@ -46,8 +111,12 @@ def main():
 
     hl.init()
 
-    for dataset in datasets_to_prepare:
-        prepare_dataset(dataset)
+    with pipeline_metrics("prepare_datasets"):
+        gene_model_ids = get_gene_model_ids()
+        for dataset in datasets_to_prepare:
+            if not args.sample:
+                prepare_dataset(dataset)
+            profile_dataset(dataset, gene_model_ids=gene_model_ids, sample=args.sample)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,11 @@
+import hashlib
+
 import hail as hl
 
 from data_pipeline.config import pipeline_config
+from data_pipeline.joins import get_lookup
+from data_pipeline.metrics import pipeline_metrics, step
+from data_pipeline.partitioning import get_n_partitions
 
 
 def get_exons(gencode):
@@ -59,15 +64,81 @@ def get_transcripts(gencode):
     return transcripts
 
 
-def load_gencode_gene_models(gtf_path, reference_genome):
+# Increment when the fields or features kept from GTF files change to invalidate cached tables
+GTF_CACHE_VERSION = 1
+
+
+def get_file_cache_key(path):
+    """
+    Get a key for a file that changes when the file is replaced.
+
+    The key is based on the file's path, size, and modification time, so that getting it does not require
+    reading the whole file.
+    """
+    stat = hl.hadoop_stat(path)
+    return hashlib.sha256(f"{path}:{stat['size_bytes']}:{stat['modification_time']}".encode()).hexdigest()[:16]
+
+
+def import_gencode(gtf_path, reference_genome):
+    """
+    Import the features and fields used for gene models from a GTF file.
+
+    The parsed GTF file is checkpointed to a table named by the file's path, size, and modification time in
+    the GTF cache (the `gtf_cache_path` option in the `reference_data` section of pipeline_config.ini, defaults
+    to `{staging_path}/gtf_cache`), so that later runs with the same file skip parsing it.
+    """
+    cache_path = pipeline_config.get(
+        "reference_data", "gtf_cache_path", fallback=f"{pipeline_config.get('output', 'staging_path')}/gtf_cache"
+    )
+    checkpoint_path = f"{cache_path}/{reference_genome}_v{GTF_CACHE_VERSION}_{get_file_cache_key(gtf_path)}.ht"
+
+    if hl.hadoop_exists(f"{checkpoint_path}/_SUCCESS"):
+        print(f"Using parsed {gtf_path} from {checkpoint_path}")
+        return hl.read_table(checkpoint_path)
+
     gencode = hl.experimental.import_gtf(
-        gtf_path, reference_genome=reference_genome, min_partitions=100, skip_invalid_contigs=True
+        gtf_path,
+        reference_genome=reference_genome,
+        min_partitions=get_n_partitions(gtf_path),
+        skip_invalid_contigs=True,
     )
+    gencode = gencode.filter(hl.set(["gene", "transcript", "exon", "CDS", "UTR"]).contains(gencode.feature))
+    gencode = gencode.select("feature", "gene_id", "gene_name", "transcript_id", "strand")
+
+    with step(f"gene_models.{reference_genome.lower()}.parse_gtf", output_path=checkpoint_path):
+        gencode = gencode.checkpoint(checkpoint_path, overwrite=True)
+
+    return gencode
+
+
+def load_gencode_gene_models(gtf_path, reference_genome, canonical_transcripts):
+    """
+    Load genes from a GTF file, with each gene's canonical transcript (and its exons) in `transcripts`.
+
+    Other transcripts are not used, so they and their exons are dropped before exons are grouped by
+    transcript and transcripts are grouped by gene.
+    """
+    gencode = import_gencode(gtf_path, reference_genome)
 
     # Extract genes, transcripts, and exons from the GTF file
     genes = get_genes(gencode)
     transcripts = get_transcripts(gencode)
     exons = get_exons(gencode)
+
+    # Keep only transcripts (and their exons) that are the canonical transcript for their gene
+    canonical_transcript_genes = get_lookup(
+        canonical_transcripts.group_by(canonical_transcripts.transcript_id).aggregate(
+            gene_ids=hl.agg.collect_as_set(canonical_transcripts.gene_id)
+        ),
+        name=f"{reference_genome} canonical transcripts",
+    )
+
+    def _is_canonical(feature):
+        return hl.or_else(canonical_transcript_genes(feature.transcript_id).gene_ids.contains(feature.gene_id), False)
+
+    transcripts = transcripts.filter(_is_canonical(transcripts))
+
+    exons = exons.filter(_is_canonical(exons))
     exons = exons.cache()
 
     # Annotate transcripts with their exons
@@ -91,14 +162,19 @@ def load_gencode_gene_models(gtf_path, reference_genome):
 
 def load_canonical_transcripts(canonical_transcripts_path):
     # Canonical transcripts file is a TSV with two columns: gene ID and transcript ID and no header row
-    canonical_transcripts = hl.import_table(canonical_transcripts_path, force=True, no_header=True, min_partitions=100)
+    canonical_transcripts = hl.import_table(
+        canonical_transcripts_path,
+        force=True,
+        no_header=True,
+        min_partitions=get_n_partitions(canonical_transcripts_path),
+    )
     canonical_transcripts = canonical_transcripts.rename({"f0": "gene_id", "f1": "transcript_id"})
     canonical_transcripts = canonical_transcripts.key_by("gene_id")
     return canonical_transcripts
 
 
 def load_hgnc(hgnc_path):
-    hgnc = hl.import_table(hgnc_path, min_partitions=100, missing="")
+    hgnc = hl.import_table(hgnc_path, min_partitions=get_n_partitions(hgnc_path), missing="")
     hgnc = hgnc.select(
         hgnc_id=hgnc["HGNC ID"],
         symbol=hgnc["Approved symbol"],
@@ -118,16 +194,19 @@ def prepare_gene_models_helper(reference_genome):
         "reference_data", f"{reference_genome.lower()}_canonical_transcripts_path"
     )
 
+    canonical_transcripts = load_canonical_transcripts(canonical_transcripts_path)
+
     # Load genes from GTF file
-    genes = load_gencode_gene_models(gencode_path, reference_genome)
+    genes = load_gencode_gene_models(gencode_path, reference_genome, canonical_transcripts)
     genes = genes.distinct()
     genes = genes.transmute(gencode_gene_symbol=genes.gene_symbol)
 
     # Annotate genes with canonical transcript
-    canonical_transcripts = load_canonical_transcripts(canonical_transcripts_path)
-    genes = genes.annotate(canonical_transcript_id=canonical_transcripts[genes.gene_id].transcript_id)
+    canonical_transcripts = get_lookup(canonical_transcripts, name=f"{reference_genome} canonical transcripts")
+    genes = genes.annotate(canonical_transcript_id=canonical_transcripts(genes.gene_id).transcript_id)
 
-    # Drop transcripts except for canonical
+    # Transcripts loaded from the GTF file are already limited to canonical transcripts, but filter by ID
+    # in case the canonical transcripts file lists more than one transcript for a gene
     genes = genes.annotate(
         canonical_transcript=genes.transcripts.filter(
             lambda transcript: transcript.transcript_id == genes.canonical_transcript_id
@@ -217,12 +296,14 @@ def prepare_gene_models():
     genes_grch37 = genes_grch37.select(GRCh37=genes_grch37.row_value)
     genes_grch38 = genes_grch38.select(GRCh38=genes_grch38.row_value)
 
+    # Neither reference genome's gene models are written on their own. The two are computed as independent
+    # branches of the join when gene models are written.
     genes = genes_grch37.join(genes_grch38, how="outer")
 
     # Annotate genes with information from HGNC
     hgnc_path = pipeline_config.get("reference_data", "hgnc_path")
-    hgnc = load_hgnc(hgnc_path)
-    genes = genes.annotate(**hgnc[genes.gene_id])
+    hgnc = get_lookup(load_hgnc(hgnc_path), name="HGNC")
+    genes = genes.annotate(**hgnc(genes.gene_id))
     genes = genes.annotate(
         symbol=hl.or_else(genes.symbol, hl.or_else(genes.GRCh38.gencode_gene_symbol, genes.GRCh37.gencode_gene_symbol)),
     )
@@ -242,19 +323,21 @@ def prepare_gene_models():
     )
 
     gnomad_constraint_path = pipeline_config.get("reference_data", "gnomad_constraint_path")
-    gnomad_constraint = prepare_gnomad_constraint(gnomad_constraint_path)
-    genes = genes.annotate(gnomad_constraint=gnomad_constraint[genes.GRCh37.canonical_transcript_id])
+    gnomad_constraint = get_lookup(prepare_gnomad_constraint(gnomad_constraint_path), name="gnomAD constraint")
+    genes = genes.annotate(gnomad_constraint=gnomad_constraint(genes.GRCh37.canonical_transcript_id))
 
     exac_constraint_path = pipeline_config.get("reference_data", "exac_constraint_path")
-    exac_constraint = prepare_exac_constraint(exac_constraint_path)
-    genes = genes.annotate(exac_constraint=exac_constraint[genes.GRCh37.canonical_transcript_id])
+    exac_constraint = get_lookup(prepare_exac_constraint(exac_constraint_path), name="ExAC constraint")
+    genes = genes.annotate(exac_constraint=exac_constraint(genes.GRCh37.canonical_transcript_id))
 
     staging_path = pipeline_config.get("output", "staging_path")
 
-    genes.write(f"{staging_path}/gene_models.ht", overwrite=True)
+    with step("gene_models.write", output_path=f"{staging_path}/gene_models.ht"):
+        genes.write(f"{staging_path}/gene_models.ht", overwrite=True)
 
 
 if __name__ == "__main__":
     hl.init()
 
-    prepare_gene_models()
+    with pipeline_metrics("prepare_gene_models"):
+        prepare_gene_models()
@@ -0,0 +1,168 @@
+"""
+Profiling for work done in worker processes.
+
+Worker processes started with `start_worker_profiler` as their initializer run under cProfile and
+write their stats to `{profile_directory}/worker-{pid}.prof` when they exit. Time spent in phases of
+work can be recorded with a `PhaseTimer`. `write_profile_report` merges workers' stats with phase
+times and per-item times collected by the parent process into one report.
+"""
+
+import bisect
+import collections
+import contextlib
+import cProfile
+import glob
+import json
+import multiprocessing.util
+import os
+import pstats
+import time
+
+
+class PhaseTimer:
+    """
+    Accumulate time spent in named phases. Phases can be nested, in which case time is only
+    counted towards the innermost phase.
+    """
+
+    def __init__(self):
+        self.times = collections.Counter()
+        self._stack = []
+        self._last_time = None
+
+    def enter(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            self.times[self._stack[-1]] += now - self._last_time
+        self._stack.append(name)
+        self._last_time = now
+
+    def exit(self):
+        now = time.perf_counter()
+        self.times[self._stack.pop()] += now - self._last_time
+        self._last_time = now
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def timed(self, iterable, name):
+        """
+        Count time spent getting each item from an iterable towards a phase.
+        """
+        iterator = iter(iterable)
+        while True:
+            self.enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.exit()
+            yield item
+
+
+class NullPhaseTimer:
+    """
+    Phase timer that does not record anything.
+    """
+
+    times = {}
+
+    def phase(self, name):  # pylint: disable=unused-argument,no-self-use
+        return contextlib.nullcontext()
+
+    def timed(self, iterable, name):  # pylint: disable=unused-argument,no-self-use
+        return iterable
+
+
+_worker_profiler = None  # pylint: disable=invalid-name
+
+
+def _stop_worker_profiler(profile_directory):
+    _worker_profiler.disable()
+    _worker_profiler.dump_stats(f"{profile_directory}/worker-{os.getpid()}.prof")
+
+
+def start_worker_profiler(profile_directory):
+    """
+    Profile the current process until it exits. Use as a multiprocessing.Pool initializer.
+
+    Stats are only written if the process exits normally, so pools must be closed and joined
+    instead of terminated.
+    """
+    global _worker_profiler  # pylint: disable=global-statement,invalid-name
+    _worker_profiler = cProfile.Profile()
+    _worker_profiler.enable()
+    multiprocessing.util.Finalize(None, _stop_worker_profiler, args=(profile_directory,), exitpriority=10)
+
+
+def remove_worker_profiles(profile_directory):
+    for path in glob.glob(f"{profile_directory}/worker-*.prof"):
+        os.remove(path)
+
+
+# Upper bounds of histogram buckets in seconds
+HISTOGRAM_BUCKETS = [0.001, 0.01, 0.1, 1, 10, 100]
+
+
+def get_time_histogram(times):
+    counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+    for seconds in times:
+        counts[bisect.bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+
+    labels = [f"< {bound}s" for bound in HISTOGRAM_BUCKETS] + [f">= {HISTOGRAM_BUCKETS[-1]}s"]
+    return dict(zip(labels, counts))
+
+
+def write_profile_report(profile_directory, phase_times, item_times, n_slowest=20, n_functions=50):
+    """
+    Write a report of time spent in each phase, a histogram of time per item, the slowest items, and
+    the functions with the most cumulative time across all workers.
+
+    Writes `report.txt` and `report.json` and merges workers' stats into `workers.prof`, which can be
+    viewed with tools such as snakeviz.
+
+    `item_times` is a list of (item, seconds) tuples.
+    """
+    total_phase_time = sum(phase_times.values()) or 1
+    histogram = get_time_histogram(seconds for _, seconds in item_times)
+    slowest_items = sorted(item_times, key=lambda item: item[1], reverse=True)[:n_slowest]
+
+    with open(f"{profile_directory}/report.json", "w") as report_file:
+        json.dump(
+            {
+                "phases": dict(phase_times),
+                "n_items": len(item_times),
+                "histogram": histogram,
+                "slowest_items": slowest_items,
+            },
+            report_file,
+            indent=2,
+        )
+
+    with open(f"{profile_directory}/report.txt", "w") as report_file:
+        print("Time in phases (all workers)", file=report_file)
+        for phase, seconds in phase_times.most_common():
+            print(f"  {phase:<12} {seconds:10.2f}s {100 * seconds / total_phase_time:6.1f}%", file=report_file)
+
+        print(f"\nTime per item ({len(item_times)} items)", file=report_file)
+        for label, count in histogram.items():
+            print(f"  {label:<10} {count:8}", file=report_file)
+
+        print("\nSlowest items", file=report_file)
+        for item, seconds in slowest_items:
+            print(f"  {item:<20} {seconds:10.3f}s", file=report_file)
+
+        worker_profiles = glob.glob(f"{profile_directory}/worker-*.prof")
+        if worker_profiles:
+            stats = pstats.Stats(*worker_profiles, stream=report_file)
+            stats.dump_stats(f"{profile_directory}/workers.prof")
+            print(f"\nFunctions ({len(worker_profiles)} workers)", file=report_file)
+            stats.sort_stats("cumulative").print_stats(n_functions)
+
+    print(f"Wrote profile report to {profile_directory}/report.txt")
@@ -0,0 +1,138 @@
+"""
+Report sizes of results files and check them against budgets.
+
+Budgets are configured in the `size_budgets` section of pipeline_config.ini:
+
+- `dataset_total_growth` - maximum ratio of a dataset's total size to its size in the previous report
+- `gene_p99_growth` - maximum ratio of the 99th percentile of a dataset's per-gene size to the previous report
+- `largest_gene_growth` - maximum ratio of the size of a dataset's largest gene to the previous report
+- `max_gene_mb` - maximum size of any gene's files for a dataset
+- `on_exceeded` - `warn` (default) to print a warning or `fail` to raise an error if a budget is exceeded
+"""
+
+import configparser
+import json
+import math
+import os
+
+
+PERCENTILES = [50, 90, 99]
+
+N_LARGEST_GENES = 20
+
+GROWTH_BUDGETS = {
+    "dataset_total_growth": ("total_bytes", "total size"),
+    "gene_p99_growth": ("gene_bytes_p99", "99th percentile gene size"),
+    "largest_gene_growth": ("gene_bytes_max", "largest gene size"),
+}
+
+
+def get_percentile(sorted_values, percentile):
+    """
+    Get a percentile of a sorted list using the nearest rank method.
+    """
+    if not sorted_values:
+        return None
+    return sorted_values[max(math.ceil(percentile / 100 * len(sorted_values)) - 1, 0)]
+
+
+def build_size_report(gene_sizes, field_bytes, other_file_sizes, complete=True):
+    """
+    Build a size report.
+
+    `gene_sizes` maps each dataset (or "gene" for files not specific to a dataset) to a list of (gene ID, bytes)
+    tuples. `field_bytes` maps each dataset to counts of variants, sampled variants, and bytes used by each
+    field in sampled variants. `other_file_sizes` maps each dataset to the size of other files for the dataset
+    (such as gene results files).
+    """
+    datasets = {}
+    for dataset in sorted(set(gene_sizes) | set(other_file_sizes)):
+        dataset_gene_sizes = sorted(gene_sizes.get(dataset, []), key=lambda gene: gene[1])
+        sizes = [size for _, size in dataset_gene_sizes]
+
+        dataset_report = {
+            "total_bytes": sum(sizes) + other_file_sizes.get(dataset, 0),
+            "gene_files_bytes": sum(sizes),
+            "other_files_bytes": other_file_sizes.get(dataset, 0),
+            "n_genes": len(sizes),
+            **{f"gene_bytes_p{percentile}": get_percentile(sizes, percentile) for percentile in PERCENTILES},
+            "gene_bytes_max": sizes[-1] if sizes else None,
+            "largest_genes": [
+                {"gene_id": gene_id, "bytes": size} for gene_id, size in reversed(dataset_gene_sizes[-N_LARGEST_GENES:])
+            ],
+        }
+
+        dataset_field_bytes = field_bytes.get(dataset)
+        if dataset_field_bytes and dataset_field_bytes["n_sampled"]:
+            # Scale bytes in sampled variants up to all variants
+            scale = dataset_field_bytes["n_variants"] / dataset_field_bytes["n_sampled"]
+            dataset_report["estimated_variant_field_bytes"] = {
+                field: round(n_bytes * scale) for field, n_bytes in dataset_field_bytes["fields"].most_common()
+            }
+
+        datasets[dataset] = dataset_report
+
+    return {"complete": complete, "datasets": datasets}
+
+
+def read_size_report(path):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as report_file:
+        return json.load(report_file)
+
+
+def check_size_budgets(report, previous_report, config_path):
+    """
+    Check a size report against budgets configured in the `size_budgets` section of pipeline_config.ini.
+
+    Prints a warning or raises an error, depending on the `on_exceeded` option, if any budget is exceeded.
+    Returns whether the report is within budgets.
+    """
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    if not config.has_section("size_budgets"):
+        return True
+
+    on_exceeded = config.get("size_budgets", "on_exceeded", fallback="warn")
+    if on_exceeded not in ("warn", "fail"):
+        raise ValueError(f"Invalid size_budgets.on_exceeded '{on_exceeded}' (choose from warn, fail)")
+
+    if not report["complete"]:
+        print("Skipping size budgets because not all genes were written in this run")
+        return True
+
+    exceeded = []
+
+    max_gene_mb = config.getfloat("size_budgets", "max_gene_mb", fallback=None)
+    for dataset, dataset_report in report["datasets"].items():
+        if max_gene_mb and (dataset_report["gene_bytes_max"] or 0) > max_gene_mb * 2 ** 20:
+            largest_gene = dataset_report["largest_genes"][0]
+            exceeded.append(
+                f"{dataset}: {largest_gene['gene_id']} is {largest_gene['bytes']} bytes (budget {max_gene_mb} MB)"
+            )
+
+    if previous_report:
+        for option, (metric, description) in GROWTH_BUDGETS.items():
+            max_growth = config.getfloat("size_budgets", option, fallback=None)
+            if not max_growth:
+                continue
+
+            for dataset, dataset_report in report["datasets"].items():
+                previous_value = previous_report["datasets"].get(dataset, {}).get(metric)
+                value = dataset_report[metric]
+                if previous_value and value and value / previous_value > max_growth:
+                    exceeded.append(
+                        f"{dataset}: {description} grew from {previous_value} to {value} bytes "
+                        f"({value / previous_value:.2f}x, budget {max_growth}x)"
+                    )
+    elif any(config.has_option("size_budgets", option) for option in GROWTH_BUDGETS):
+        print("No previous size report, skipping growth budgets")
+
+    if exceeded:
+        message = "Size budgets exceeded:\n" + "\n".join(f"  {line}" for line in exceeded)
+        if on_exceeded == "fail":
+            raise Exception(message)
+        print(f"Warning: {message}")
+
+    return not exceeded
@@ -0,0 +1,225 @@
+"""
+Generate synthetic gene models, gene results, and variant results tables for testing and benchmarking.
+
+Generated tables have the same schema as the tables written by the prepare_gene_models and
+prepare_datasets pipelines, and gene/variant results tables pass validation. Values are random, so
+tables are only useful for exercising the pipeline, not for checking results.
+"""
+
+import hail as hl
+
+
+CONSEQUENCES = [
+    "frameshift_variant",
+    "inframe_deletion",
+    "missense_variant",
+    "splice_region_variant",
+    "stop_gained",
+    "synonymous_variant",
+]
+
+POLYPHEN_PREDICTIONS = ["benign", "possibly_damaging", "probably_damaging"]
+
+BASES = ["A", "C", "G", "T"]
+
+# Keep all genes within the shortest autosome (chr21 is ~46.7 Mb in GRCh38)
+MAX_CHROM_SPAN = 40_000_000
+
+N_CHROMS = 22
+
+# Offset of genes' GRCh38 coordinates from their GRCh37 coordinates
+GRCH38_OFFSET = 1000
+
+
+def _rand_choice(values):
+    return hl.literal(values)[hl.int(hl.rand_unif(0, len(values)))]
+
+
+def _gene_model(gene_id, symbol, chrom, start, stop, strand, n_exons):
+    exon_size = (stop - start) // (2 * n_exons)
+    return hl.struct(
+        chrom=chrom,
+        strand=strand,
+        start=start,
+        stop=stop,
+        gencode_gene_symbol=symbol,
+        canonical_transcript_id=gene_id.replace("ENSG", "ENST"),
+        canonical_transcript=hl.struct(
+            transcript_id=gene_id.replace("ENSG", "ENST"),
+            strand=strand,
+            start=start,
+            stop=stop,
+            exons=hl.range(n_exons).map(
+                lambda i: hl.struct(
+                    feature_type="CDS",
+                    start=start + 2 * i * exon_size,
+                    stop=start + (2 * i + 1) * exon_size,
+                )
+            ),
+        ),
+    )
+
+
+def generate_gene_models(n_genes, n_partitions=None):
+    """
+    Generate a gene models table with `n_genes` genes spread across autosomes.
+    """
+    genes_per_chrom = -(-n_genes // N_CHROMS)
+    spacing = max(MAX_CHROM_SPAN // genes_per_chrom, 100)
+
+    ds = hl.utils.range_table(n_genes, n_partitions=n_partitions)
+    ds = ds.annotate(
+        gene_id=hl.format("ENSG%011d", ds.idx),
+        symbol=hl.format("SYN%d", ds.idx),
+        chrom=hl.str(ds.idx % N_CHROMS + 1),
+        start=(ds.idx // N_CHROMS) * spacing + 10_000,
+    )
+    ds = ds.annotate(
+        stop=ds.start + hl.int(hl.rand_unif(0.2, 0.8) * spacing),
+        strand=hl.if_else(hl.rand_bool(0.5), "+", "-"),
+        n_exons=hl.int(hl.rand_unif(1, 20)),
+    )
+
+    ds = ds.select(
+        gene_id=ds.gene_id,
+        symbol=ds.symbol,
+        name=hl.format("synthetic gene %d", ds.idx),
+        hgnc_id=hl.format("HGNC:%d", ds.idx),
+        omim_id=hl.null(hl.tstr),
+        previous_symbols=hl.empty_array(hl.tstr),
+        alias_symbols=hl.empty_array(hl.tstr),
+        search_terms=hl.set([ds.symbol]),
+        GRCh37=_gene_model(ds.gene_id, ds.symbol, ds.chrom, ds.start, ds.stop, ds.strand, ds.n_exons),
+        GRCh38=_gene_model(
+            ds.gene_id,
+            ds.symbol,
+            ds.chrom,
+            ds.start + GRCH38_OFFSET,
+            ds.stop + GRCH38_OFFSET,
+            ds.strand,
+            ds.n_exons,
+        ),
+        gnomad_constraint=hl.struct(
+            pLI=hl.rand_unif(0, 1), oe_lof=hl.rand_unif(0, 2), oe_mis=hl.rand_unif(0, 2), oe_syn=hl.rand_unif(0, 2)
+        ),
+        exac_constraint=hl.struct(pLI=hl.rand_unif(0, 1)),
+    )
+
+    return ds.key_by("gene_id")
+
+
+def generate_gene_results(gene_models, analysis_groups, gene_coverage=0.9, group_coverage=0.9):
+    """
+    Generate a gene results table with results for a random subset of genes and analysis groups.
+    """
+    ds = gene_models.select()
+    ds = ds.filter(hl.rand_bool(gene_coverage))
+
+    ds = ds.annotate(
+        group_results=hl.dict(
+            hl.literal(analysis_groups)
+            .filter(lambda group: hl.rand_bool(group_coverage))
+            .map(
+                lambda group: (
+                    group,
+                    hl.struct(
+                        xcase_lof=hl.int(hl.rand_exp(0.5)),
+                        xctrl_lof=hl.int(hl.rand_exp(0.5)),
+                        xcase_mis=hl.int(hl.rand_exp(0.2)),
+                        xctrl_mis=hl.int(hl.rand_exp(0.2)),
+                        # Skew p-values towards 0
+                        pval=hl.rand_unif(0, 1) ** 4,
+                        odds_ratio=hl.rand_gamma(2, 1),
+                    ),
+                )
+            )
+        )
+    )
+
+    return ds
+
+
+def generate_variant_results(
+    gene_models,
+    analysis_groups,
+    reference_genome="GRCh37",
+    min_variants_per_gene=10,
+    tail_index=1.2,
+    max_variants_per_gene=50_000,
+    gene_coverage=0.9,
+    group_coverage=0.7,
+):
+    """
+    Generate a variant results table with variants in a random subset of genes.
+
+    The number of variants in each gene follows a Pareto distribution with minimum `min_variants_per_gene`
+    and shape `tail_index` (capped at `max_variants_per_gene`), so that, like real data, a few genes have
+    many more variants than most.
+    """
+    genes = gene_models.select(
+        chrom=gene_models[reference_genome].chrom,
+        start=gene_models[reference_genome].start,
+        stop=gene_models[reference_genome].stop,
+    )
+    genes = genes.filter(hl.rand_bool(gene_coverage))
+    genes = genes.annotate(
+        n_variants=hl.int(
+            hl.min(min_variants_per_gene * (1 - hl.rand_unif(0, 1)) ** (-1 / tail_index), max_variants_per_gene)
+        )
+    )
+
+    ds = genes.annotate(
+        variant=hl.range(genes.n_variants).map(
+            lambda _: hl.rbind(
+                hl.int(hl.rand_unif(0, 4)),
+                lambda ref_index: hl.struct(
+                    pos=genes.start + hl.int(hl.rand_unif(0, 1) * (genes.stop - genes.start)),
+                    ref=hl.literal(BASES)[ref_index],
+                    alt=hl.literal(BASES)[(ref_index + 1 + hl.int(hl.rand_unif(0, 3))) % 4],
+                ),
+            )
+        )
+    )
+    ds = ds.explode(ds.variant)
+
+    contig = ds.chrom if reference_genome == "GRCh37" else "chr" + ds.chrom
+    ds = ds.key_by(
+        locus=hl.locus(contig, ds.variant.pos, reference_genome=reference_genome),
+        alleles=[ds.variant.ref, ds.variant.alt],
+    )
+    ds = ds.select(
+        gene_id=ds.gene_id,
+        consequence=_rand_choice(CONSEQUENCES),
+        hgvsc=hl.format("c.%d%s>%s", ds.variant.pos - ds.start + 1, ds.variant.ref, ds.variant.alt),
+        hgvs_pos=(ds.variant.pos - ds.start) // 3 + 1,
+        info=hl.struct(cadd=hl.rand_unif(0, 40), polyphen=_rand_choice(POLYPHEN_PREDICTIONS)),
+        group_results=hl.dict(
+            hl.literal(analysis_groups)
+            .filter(lambda group: hl.rand_bool(group_coverage))
+            .map(
+                lambda group: (
+                    group,
+                    hl.rbind(
+                        hl.int(hl.rand_unif(1000, 50000)),
+                        hl.int(hl.rand_unif(1000, 50000)),
+                        lambda an_case, an_ctrl: hl.struct(
+                            ac_case=hl.int(hl.rand_exp(1)),
+                            an_case=an_case,
+                            ac_ctrl=hl.int(hl.rand_exp(1)),
+                            an_ctrl=an_ctrl,
+                            p=hl.rand_unif(0, 1),
+                            in_analysis=hl.rand_bool(0.9),
+                        ),
+                    ),
+                )
+            )
+        ),
+    )
+    ds = ds.annotate(
+        hgvsp=hl.or_missing(ds.consequence != "synonymous_variant", hl.format("p.Ala%dVal", ds.hgvs_pos))
+    ).drop("hgvs_pos")
+
+    # Random positions may collide
+    ds = ds.distinct()
+
+    return ds
@@ -1,8 +1,14 @@
+import math
+
 import hail as hl
 
 
 ALLOWED_RESULT_TYPES = {hl.tbool, hl.tfloat32, hl.tfloat64, hl.tint32, hl.tint64, hl.tstr}
 
+NUMERIC_TYPES = {hl.tfloat32, hl.tfloat64, hl.tint32, hl.tint64}
+
+N_EXAMPLE_GENE_IDS = 10
+
 
 def validate_gene_results_table(ds):
     assert ds.key.dtype.fields == ("gene_id",), "Table must be keyed by gene ID"
@@ -51,3 +57,139 @@ def validate_variant_results_table(ds):
         assert (
             typ in ALLOWED_RESULT_TYPES
         ), f"'info' fields may only be one of {', '.join(map(str, ALLOWED_RESULT_TYPES))}"
+
+
+def _field_profile(expr):
+    profile = {"n_missing": hl.agg.count_where(hl.is_missing(expr))}
+    if expr.dtype in NUMERIC_TYPES:
+        profile["min"] = hl.agg.min(expr)
+        profile["max"] = hl.agg.max(expr)
+    return hl.struct(**profile)
+
+
+def sample_partitions(ds, fraction):
+    """
+    Filter a table to a fraction of its partitions, spread evenly across the table.
+    """
+    n_partitions = ds.n_partitions()
+    n_sampled = max(math.ceil(n_partitions * fraction), 1)
+    partitions = sorted({int(i * n_partitions / n_sampled) for i in range(n_sampled)})
+    print(f"Sampling {len(partitions)} of {n_partitions} partitions")
+    return ds._filter_partitions(partitions)  # pylint: disable=protected-access
+
+
+def profile_table(ds, gene_model_ids=None):
+    """
+    Profile the data in a gene or variant results table in one aggregation over the table.
+
+    The profile includes the number of rows with the same key as the previous row (keyed tables are
+    sorted, so this is the number of duplicate keys), the number of missing values and range of values
+    of each field (including key fields and fields in `info` and in each analysis group's results), and
+    the number of gene IDs that are not in `gene_model_ids`.
+    """
+    # Key and other top level fields, except info and group results
+    row_fields = [field for field in ds.row.dtype.fields if field not in ("info", "group_results")]
+    info_fields = list(ds.info.dtype.fields) if "info" in ds.row_value.dtype.fields else []
+    group_result_fields = list(ds.group_results.dtype.value_type.fields)
+
+    previous_key = hl.scan._prev_nonnull(ds.key)  # pylint: disable=protected-access
+    ds = ds.annotate(_is_duplicate_key=hl.or_else(previous_key == ds.key, False))
+
+    result = ds.aggregate(
+        hl.struct(
+            n_rows=hl.agg.count(),
+            n_duplicate_keys=hl.agg.count_where(ds["_is_duplicate_key"]),
+            row_fields=hl.struct(**{field: _field_profile(ds[field]) for field in row_fields}),
+            info_fields=hl.struct(**{field: _field_profile(ds.info[field]) for field in info_fields}),
+            n_group_results=hl.agg.explode(lambda _: hl.agg.count(), ds.group_results.values()),
+            group_result_fields=hl.agg.explode(
+                lambda group_result: hl.struct(
+                    **{field: _field_profile(group_result[field]) for field in group_result_fields}
+                ),
+                ds.group_results.values(),
+            ),
+            gene_ids=hl.agg.collect_as_set(ds.gene_id),
+        )
+    )
+
+    fields = {}
+    for prefix, field_names, field_profiles, n_values in [
+        ("", row_fields, result.row_fields, result.n_rows),
+        ("info.", info_fields, result.info_fields, result.n_rows),
+        ("group_results.", group_result_fields, result.group_result_fields, result.n_group_results),
+    ]:
+        for field in field_names:
+            field_profile = field_profiles[field]
+            fields[prefix + field] = {
+                "null_rate": field_profile.n_missing / n_values if n_values else None,
+                **({"min": field_profile.min, "max": field_profile.max} if "min" in field_profile else {}),
+            }
+
+    profile = {
+        "n_rows": result.n_rows,
+        "n_duplicate_keys": result.n_duplicate_keys,
+        "fields": fields,
+    }
+
+    gene_ids = {gene_id for gene_id in result.gene_ids if gene_id is not None}
+    if gene_model_ids is not None:
+        absent_gene_ids = sorted(gene_ids - gene_model_ids)
+        profile["gene_ids"] = {
+            "n_gene_ids": len(gene_ids),
+            "n_absent_from_gene_models": len(absent_gene_ids),
+            "fraction_absent_from_gene_models": len(absent_gene_ids) / len(gene_ids) if gene_ids else None,
+            "absent_from_gene_models_examples": absent_gene_ids[:N_EXAMPLE_GENE_IDS],
+        }
+    else:
+        profile["gene_ids"] = {"n_gene_ids": len(gene_ids)}
+
+    return profile
+
+
+def print_table_profile(profile):
+    print(f"{profile['n_rows']} rows, {profile['n_duplicate_keys']} duplicate keys")
+    for field, field_profile in profile["fields"].items():
+        line = f"  {field:<40}"
+        if field_profile["null_rate"] is not None:
+            line += f" {field_profile['null_rate']:8.2%} missing"
+        if "min" in field_profile:
+            line += f"  range {field_profile['min']} to {field_profile['max']}"
+        print(line)
+
+    gene_id_profile = profile["gene_ids"]
+    if "n_absent_from_gene_models" in gene_id_profile:
+        print(
+            f"{gene_id_profile['n_gene_ids']} gene IDs, "
+            f"{gene_id_profile['n_absent_from_gene_models']} not in gene models"
+            + (
+                f" (for example, {', '.join(gene_id_profile['absent_from_gene_models_examples'])})"
+                if gene_id_profile["n_absent_from_gene_models"]
+                else ""
+            )
+        )
+    else:
+        print(f"{gene_id_profile['n_gene_ids']} gene IDs")
+
+
+def check_table_profile(profile, unique_key=True):
+    """
+    Check a table profile for data problems.
+
+    If `unique_key` is set, raises an error if any key is duplicated. Otherwise (for example, for variant
+    results tables, where a variant may have results for more than one gene), prints a warning. Prints
+    warnings for missing gene IDs and gene IDs that are not in gene models.
+    """
+    if unique_key:
+        assert profile["n_duplicate_keys"] == 0, f"Table has {profile['n_duplicate_keys']} duplicate keys"
+    elif profile["n_duplicate_keys"]:
+        print(f"Warning: {profile['n_duplicate_keys']} rows have the same key as another row")
+
+    gene_id_null_rate = profile["fields"].get("gene_id", {}).get("null_rate")
+    if gene_id_null_rate:
+        print(f"Warning: {gene_id_null_rate:.2%} of rows are missing gene ID")
+
+    if profile["gene_ids"].get("n_absent_from_gene_models"):
+        print(
+            f"Warning: {profile['gene_ids']['fraction_absent_from_gene_models']:.2%} of gene IDs "
+            "are not in gene models"
+        )
@@ -33,6 +33,10 @@ def main():
 
     from data_pipeline.config import pipeline_config  # pylint: disable=import-outside-toplevel
 
+    metrics_path = pipeline_config.get(
+        "output", "metrics_path", fallback=f"{pipeline_config.get('output', 'staging_path')}/metrics"
+    )
+
     start_time = time.time()
 
     if args.environment == "local":
@@ -55,6 +59,7 @@ def main():
 
                 elapsed_time = time.time() - start_time
                 print(f"Done in {int(elapsed_time // 60)}m{int(elapsed_time % 60)}s")
+                print(f"Metrics reports for each step are in {metrics_path}/{args.pipeline}/")
 
             except subprocess.CalledProcessError:
                 print(f"Error running data_pipeline/pipelines/{args.pipeline}.py")
@@ -106,6 +111,7 @@ def main():
 
                 elapsed_time = time.time() - start_time
                 print(f"Done in {elapsed_time // 60}m{elapsed_time % 60}s")
+                print(f"Metrics reports for each step are in {metrics_path}/{args.pipeline}/")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+import json
+import math
+import unittest
+
+from data_pipeline.binary_encoding import FLOAT32_MAX, FLOAT32_MIN, decode_variants, encode_variants
+from write_results_files import split_data
+
+
+GENE_ID = "ENSG00000000001"
+
+METADATA = {
+    "variant_fields": ["variant_id", "pos", "consequence", "hgvsc", "hgvsp", "info", "group_results"],
+    "datasets": {
+        "TEST": {
+            "reference_genome": "GRCh37",
+            "gene_result_analysis_groups": [],
+            "gene_group_result_field_names": [],
+            "gene_group_result_field_types": [],
+            "variant_info_field_names": ["cadd", "polyphen", "in_analysis"],
+            "variant_info_field_types": ["float", "str", "bool"],
+            "variant_result_analysis_groups": ["group1", "group2"],
+            "variant_group_result_field_names": ["ac_case", "an_case", "p", "in_analysis"],
+            "variant_group_result_field_types": ["int", "int", "float", "bool"],
+        }
+    },
+}
+
+VARIANTS = [
+    ["1-100-A-G", 100, "missense_variant", "c.1A>G", "p.Met1Val", [12.5, "benign", True], [[1, 1000, 0.5, True], None]],
+    # Missing values
+    ["1-101-C-T", 101, "synonymous_variant", "c.2C>T", None, [None, None, None], [None, [0, None, None, None]]],
+    # Very small p-values, outside of the 32 bit float range
+    [
+        "1-102-G-A",
+        102,
+        "stop_gained",
+        "c.3G>A",
+        "p.Trp1Ter",
+        [0.0, "", False],
+        [[2, 2000, 1e-40, False], [3, 3000, 1e-300, True]],
+    ],
+    # Boundaries of the 32 bit float range and large and negative ints
+    [
+        "1-103-T-C",
+        2 ** 31,
+        "missense_variant",
+        "c.4T>C",
+        "p.Ünïcode",
+        [FLOAT32_MIN, "probably_damaging", True],
+        [[2 ** 40, 0, FLOAT32_MAX, True], [-(2 ** 40), -1, -2.5, False]],
+    ],
+]
+
+
+def get_gene_row(variants):
+    gene = {
+        "gene_id": GENE_ID,
+        "symbol": "TEST1",
+        "GRCh37": {"chrom": "1", "start": 100, "stop": 200, "strand": "+"},
+        "GRCh38": None,
+        "gene_results": {"TEST": None},
+        "variants": {"TEST": variants},
+    }
+    return [GENE_ID, json.dumps(gene)]
+
+
+def assert_values_equal(test_case, json_value, decoded_value, path="variants"):
+    """
+    Compare values decoded from a binary variants file to the same values in the JSON variants file.
+
+    Floats in the JSON file are rounded and floats in the binary file may be stored as 32 bit floats,
+    so floats only need to be close.
+    """
+    if isinstance(json_value, list):
+        test_case.assertIsInstance(decoded_value, list, path)
+        test_case.assertEqual(len(json_value), len(decoded_value), path)
+        for i, (json_item, decoded_item) in enumerate(zip(json_value, decoded_value)):
+            assert_values_equal(test_case, json_item, decoded_item, f"{path}[{i}]")
+    elif isinstance(decoded_value, float):
+        test_case.assertIsInstance(json_value, (int, float), path)
+        test_case.assertTrue(
+            math.isclose(json_value, decoded_value, rel_tol=1e-4), f"{path}: {json_value} != {decoded_value}"
+        )
+    else:
+        test_case.assertEqual(json_value, decoded_value, path)
+
+
+class BinaryVariantsRoundTripTest(unittest.TestCase):
+    def write_files(self, variants):
+        return dict(split_data(get_gene_row(variants), metadata=METADATA, binary_variants=True))
+
+    def test_round_trip_matches_json(self):
+        files = self.write_files(VARIANTS)
+
+        json_variants = json.loads(files[f"{GENE_ID}_test_variants.json"])["variants"]
+        decoded_variants = decode_variants(
+            files[f"{GENE_ID}_test_variants.bin"], METADATA["variant_fields"], METADATA["datasets"]["TEST"]
+        )
+
+        assert_values_equal(self, json_variants, decoded_variants)
+
+    def test_small_floats_are_not_flushed_to_zero(self):
+        files = self.write_files(VARIANTS)
+
+        decoded_variants = decode_variants(
+            files[f"{GENE_ID}_test_variants.bin"], METADATA["variant_fields"], METADATA["datasets"]["TEST"]
+        )
+
+        self.assertEqual(decoded_variants[2][6][0][2], 1e-40)
+        self.assertEqual(decoded_variants[2][6][1][2], 1e-300)
+
+    def test_round_trip_empty_list(self):
+        data = encode_variants([], METADATA["variant_fields"], METADATA["datasets"]["TEST"])
+        self.assertEqual(decode_variants(data, METADATA["variant_fields"], METADATA["datasets"]["TEST"]), [])
+
+    def test_rejects_other_data(self):
+        with self.assertRaises(ValueError):
+            decode_variants(b"{}", METADATA["variant_fields"], METADATA["datasets"]["TEST"])
+
+
+if __name__ == "__main__":
+    unittest.main()
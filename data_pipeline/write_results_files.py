@@ -1,18 +1,68 @@
 #!/usr/bin/env python3
 
 import argparse
+import collections
+import configparser
 import csv
+import functools
+import glob
 import json
+import math
 from json.encoder import encode_basestring_ascii, _make_iterencode
 import multiprocessing
 import os
+import re
+import sqlite3
 import sys
+import threading
+import time
 
 import hail as hl
 from tqdm import tqdm
 
+from data_pipeline.binary_encoding import encode_variants
+from data_pipeline.profiling import (
+    NullPhaseTimer,
+    PhaseTimer,
+    remove_worker_profiles,
+    start_worker_profiler,
+    write_profile_report,
+)
+from data_pipeline.size_report import build_size_report, check_size_budgets, read_size_report
+
 INFINITY = float("inf")
 
+PIPELINE_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline_config.ini")
+
+JSON_DECODER = json.JSONDecoder()
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+# Gene result fields that are ranked in top hits files and gene summaries
+P_VALUE_FIELD_PATTERN = re.compile(r"^p\b|pval|qval", re.IGNORECASE)
+
+
+def format_float(value):
+    if value != value:
+        return '"NaN"'
+    elif value == INFINITY:
+        return '"Infinity"'
+    elif value == -INFINITY:
+        return '"-Infinity"'
+
+    return "{:.5g}".format(value)
+
+
+class FormattedFloat(float):
+    """
+    Float with a specific JSON representation.
+    """
+
+    def __new__(cls, value, text):
+        obj = super().__new__(cls, value)
+        obj.text = text
+        return obj
+
 
 class ResultEncoder(json.JSONEncoder):
     """
@@ -27,14 +77,10 @@ class ResultEncoder(json.JSONEncoder):
 
     def iterencode(self, o, _one_shot=False):
         def floatstr(o, **kwargs):  # pylint: disable=unused-argument
-            if o != o:
-                return '"NaN"'
-            elif o == INFINITY:
-                return '"Infinity"'
-            elif o == -INFINITY:
-                return '"-Infinity"'
+            if isinstance(o, FormattedFloat):
+                return o.text
 
-            return "{:.5g}".format(o)
+            return format_float(o)
 
         _iterencode = _make_iterencode(
             {},
@@ -51,43 +97,847 @@ class ResultEncoder(json.JSONEncoder):
         return _iterencode(o, 0)
 
 
-def split_data(row):
+FIELD_ENCODINGS = ("significant_digits", "decimals", "neglog10", "int")
+
+
+def parse_field_encoding(policy):
+    """
+    Parse an encoding policy from the `encoding` section of pipeline_config.ini.
+
+    Policies are one of:
+    - significant_digits:N - round to N significant digits
+    - decimals:N - round to N decimal places
+    - neglog10:N - store -log10 of the value, rounded to N decimal places. Values must be in (0, 1] (0 is
+      stored as Infinity). Other values are stored as NaN, so that they cannot be mistaken for -log10 values.
+    - int - store integer valued floats as integers
+    """
+    name, _, digits = policy.strip().partition(":")
+    if name not in FIELD_ENCODINGS:
+        raise ValueError(f"Unknown field encoding '{policy}' (choose from {', '.join(FIELD_ENCODINGS)})")
+    if name != "int" and not digits.isdigit():
+        raise ValueError(f"Field encoding '{policy}' requires a number of digits")
+    return (name, int(digits) if digits else None)
+
+
+def get_field_encodings(config_path, metadata):
+    """
+    Get encoding policies for each dataset's gene result, variant info, and variant result fields.
+
+    Policies are configured in the `encoding` section of pipeline_config.ini with options named
+    `dataset.field`, where dataset may be `*` to match all datasets. Dataset and field names are
+    matched case insensitively.
+    """
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    if not config.has_section("encoding"):
+        return {}
+
+    policies = {option: parse_field_encoding(value) for option, value in config.items("encoding")}
+
+    def _get_field_policies(dataset, fields):
+        return [
+            policies.get(f"{dataset.lower()}.{field.lower()}", policies.get(f"*.{field.lower()}")) for field in fields
+        ]
+
+    field_encodings = {}
+    for dataset, dataset_metadata in metadata["datasets"].items():
+        dataset_encodings = {
+            "gene_group_result": _get_field_policies(dataset, dataset_metadata["gene_group_result_field_names"]),
+            "variant_info": _get_field_policies(dataset, dataset_metadata["variant_info_field_names"]),
+            "variant_group_result": _get_field_policies(dataset, dataset_metadata["variant_group_result_field_names"]),
+        }
+        if any(policy for field_policies in dataset_encodings.values() for policy in field_policies):
+            field_encodings[dataset] = dataset_encodings
+
+    return field_encodings
+
+
+def encode_value(value, policy):
+    if not isinstance(value, float):
+        return value
+
+    name, digits = policy
+    if name == "int":
+        return int(value) if value.is_integer() else value
+
+    if value != value or value in (INFINITY, -INFINITY):
+        return value
+
+    if name == "neglog10":
+        if value == 0:
+            return FormattedFloat(INFINITY, '"Infinity"')
+        if not 0 < value <= 1:
+            return FormattedFloat(math.nan, '"NaN"')
+        # Avoid -0 for p-values of 1
+        value = -math.log10(value) if value < 1 else 0.0
+
+    if name == "significant_digits":
+        text = "{:.{}g}".format(value, digits)
+    else:
+        text = "{:.{}f}".format(value, digits)
+        if "." in text:
+            text = text.rstrip("0").rstrip(".")
+
+    return FormattedFloat(float(text), text)
+
+
+def encode_fields(values, field_names, policies, bytes_saved):
+    """
+    Apply encoding policies to the values of a tuple of fields. Counts the bytes saved compared to the
+    default encoding for each field in `bytes_saved`.
+    """
+    if values is None:
+        return values
+
+    encoded_values = list(values)
+    for i, policy in enumerate(policies):
+        if policy and isinstance(values[i], float):
+            encoded_values[i] = encode_value(values[i], policy)
+            default_text = format_float(values[i])
+            if isinstance(encoded_values[i], FormattedFloat):
+                encoded_text = encoded_values[i].text
+            else:
+                encoded_text = json.dumps(encoded_values[i], cls=ResultEncoder)
+            bytes_saved[field_names[i]] += len(default_text) - len(encoded_text)
+
+    return encoded_values
+
+
+def encode_variant_fields(variant, variant_fields, dataset_metadata, dataset_encodings, bytes_saved):
+    info_index = variant_fields.index("info")
+    group_results_index = variant_fields.index("group_results")
+
+    variant = list(variant)
+    variant[info_index] = encode_fields(
+        variant[info_index],
+        dataset_metadata["variant_info_field_names"],
+        dataset_encodings["variant_info"],
+        bytes_saved,
+    )
+    variant[group_results_index] = [
+        encode_fields(
+            group_result,
+            dataset_metadata["variant_group_result_field_names"],
+            dataset_encodings["variant_group_result"],
+            bytes_saved,
+        )
+        for group_result in variant[group_results_index]
+    ]
+    return variant
+
+
+def encode_gene_group_results(group_results, dataset_metadata, dataset_encodings, bytes_saved):
+    return [
+        encode_fields(
+            group_result,
+            dataset_metadata["gene_group_result_field_names"],
+            dataset_encodings["gene_group_result"],
+            bytes_saved,
+        )
+        for group_result in group_results
+    ]
+
+
+def paginate_variants(variants, variant_fields, analysis_groups, page_size):
+    """
+    Split a gene's variants into pages of at most `page_size` variants, sorted by position
+    (the default sort order of the variants table).
+
+    Returns a header describing the pages and the list of pages.
+    """
+    variant_id_index = variant_fields.index("variant_id")
+    pos_index = variant_fields.index("pos")
+    group_results_index = variant_fields.index("group_results")
+
+    variants = sorted(variants, key=lambda variant: (variant[pos_index], variant[variant_id_index]))
+    pages = [variants[i : i + page_size] for i in range(0, len(variants), page_size)]
+
+    header = {
+        "n_variants": len(variants),
+        "n_variants_by_analysis_group": {
+            group: sum(1 for variant in variants if variant[group_results_index][i] is not None)
+            for i, group in enumerate(analysis_groups)
+        },
+        "page_size": page_size,
+        "pages": [
+            {
+                "n_variants": len(page),
+                "first_variant_id": page[0][variant_id_index],
+                "last_variant_id": page[-1][variant_id_index],
+                "start": page[0][pos_index],
+                "stop": page[-1][pos_index],
+            }
+            for page in pages
+        ],
+    }
+
+    return header, pages
+
+
+def split_variants_by_analysis_group(variants, variant_fields, analysis_groups):
+    """
+    Separate variants' group results from their annotations.
+
+    Returns the list of variants without group results and, for each analysis group, a list of
+    that group's results for each variant (in the same order as the variants).
+    """
+    group_results_index = variant_fields.index("group_results")
+
+    shared_variants = [variant[:group_results_index] + variant[group_results_index + 1 :] for variant in variants]
+    results_by_group = {
+        group: [variant[group_results_index][i] for variant in variants] for i, group in enumerate(analysis_groups)
+    }
+
+    return shared_variants, results_by_group
+
+
+class JSONCursor:
+    """
+    Reads a JSON document one value at a time.
+
+    This allows iterating over the items in large objects and arrays without decoding the entire document.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.index = 0
+
+    def _read_delimiter(self, delimiters):
+        self.index = WHITESPACE.match(self.text, self.index).end()
+        char = self.text[self.index : self.index + 1]
+        if not char or char not in delimiters:
+            raise ValueError(f"Expected one of '{delimiters}' at position {self.index}")
+        self.index += 1
+        return char
+
+    def _at(self, char):
+        self.index = WHITESPACE.match(self.text, self.index).end()
+        return self.text.startswith(char, self.index)
+
+    def decode(self):
+        """
+        Decode the next value.
+        """
+        self.index = WHITESPACE.match(self.text, self.index).end()
+        value, self.index = JSON_DECODER.raw_decode(self.text, self.index)
+        return value
+
+    def iter_object_keys(self):
+        """
+        Iterate over keys of the next object. The value for each key must be read before advancing to the next key.
+        """
+        self._read_delimiter("{")
+        if self._at("}"):
+            self.index += 1
+            return
+
+        while True:
+            key = self.decode()
+            self._read_delimiter(":")
+            yield key
+            if self._read_delimiter(",}") == "}":
+                return
+
+    def iter_array_values(self):
+        """
+        Iterate over the decoded elements of the next array. A null value is treated as an empty array.
+        """
+        if self._at("null"):
+            self.index += 4
+            return
+
+        self._read_delimiter("[")
+        if self._at("]"):
+            self.index += 1
+            return
+
+        while True:
+            yield self.decode()
+            if self._read_delimiter(",]") == "]":
+                return
+
+    def iter_array_encoded_values(self):
+        """
+        Iterate over elements of the next array, yielding both the decoded element and its JSON text.
+        """
+        self._read_delimiter("[")
+        if self._at("]"):
+            self.index += 1
+            return
+
+        while True:
+            self.index = WHITESPACE.match(self.text, self.index).end()
+            start = self.index
+            value = self.decode()
+            yield value, self.text[start : self.index]
+            if self._read_delimiter(",]") == "]":
+                return
+
+
+def split_variants_data(gene_id, dataset, dataset_variants, metadata, variant_page_size, variant_paging_threshold):
+    # Split variants for very large genes into pages so that the first page can be loaded quickly
+    if variant_page_size and len(dataset_variants) > variant_paging_threshold:
+        header, pages = paginate_variants(
+            dataset_variants,
+            metadata["variant_fields"],
+            metadata["datasets"][dataset]["variant_result_analysis_groups"],
+            variant_page_size,
+        )
+        yield f"{gene_id}_{dataset.lower()}_variants_pages.json", json.dumps(header, cls=ResultEncoder)
+        for page_number, page in enumerate(pages):
+            yield (
+                f"{gene_id}_{dataset.lower()}_variants_page_{page_number}.json",
+                json.dumps({"variants": page}, cls=ResultEncoder),
+            )
+
+
+def get_file_name_slug(name):
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+
+
+def get_analysis_group_file_names(gene_id, dataset, analysis_groups):
+    """
+    Get the name of the file for each analysis group's variant results.
+
+    Analysis group names may contain characters that are not safe in file names, so file names use a
+    slug of the group name, prefixed with "group_" so that they cannot collide with other variants files
+    (such as `_variants_shared.json` or `_variants_page_0.json`). If two groups' slugs are the same,
+    the group's index is added to the later one.
+    """
+    file_names = {}
+    used_slugs = set()
+    for i, group in enumerate(analysis_groups):
+        slug = get_file_name_slug(group) or str(i)
+        while slug in used_slugs:
+            slug = f"{slug}_{i}"
+        used_slugs.add(slug)
+        file_names[group] = f"{gene_id}_{dataset.lower()}_variants_group_{slug}.json"
+    return file_names
+
+
+def split_analysis_groups_data(gene_id, dataset, dataset_variants, metadata):
+    # Write group results for each analysis group separately so that clients only need to fetch one group
+    analysis_groups = metadata["datasets"][dataset]["variant_result_analysis_groups"]
+    shared_variants, results_by_group = split_variants_by_analysis_group(
+        dataset_variants,
+        metadata["variant_fields"],
+        analysis_groups,
+    )
+    file_names = get_analysis_group_file_names(gene_id, dataset, analysis_groups)
+    yield (
+        f"{gene_id}_{dataset.lower()}_variants_shared.json",
+        json.dumps({"variants": shared_variants, "analysis_group_files": file_names}, cls=ResultEncoder),
+    )
+    for group, group_results in results_by_group.items():
+        yield (
+            file_names[group],
+            json.dumps({"group_results": group_results}, cls=ResultEncoder),
+        )
+
+
+# Bytes used by each field are counted for one in this many variants
+FIELD_BYTES_SAMPLE_INTERVAL = 100
+
+
+def sample_variant_field_bytes(variants, variant_fields, dataset_metadata, field_bytes):
+    """
+    Count the bytes used by each field in the JSON encoding of a sample of variants.
+    """
+    encoder = ResultEncoder()
+    info_field_names = dataset_metadata["variant_info_field_names"]
+    group_result_field_names = dataset_metadata["variant_group_result_field_names"]
+    fields = field_bytes["fields"]
+
+    for i, variant in enumerate(variants):
+        field_bytes["n_variants"] += 1
+        if i % FIELD_BYTES_SAMPLE_INTERVAL == 0:
+            field_bytes["n_sampled"] += 1
+            for field, value in zip(variant_fields, variant):
+                if field == "info" and value is not None:
+                    for info_field, info_value in zip(info_field_names, value):
+                        fields[f"info.{info_field}"] += len(encoder.encode(info_value))
+                elif field == "group_results":
+                    for group_result in value:
+                        if group_result is None:
+                            fields["group_results.null"] += len("null")
+                            continue
+                        for group_result_field, group_result_value in zip(group_result_field_names, group_result):
+                            fields[f"group_results.{group_result_field}"] += len(encoder.encode(group_result_value))
+                else:
+                    fields[field] += len(encoder.encode(value))
+
+        yield variant
+
+
+def get_gene_summary(gene, n_variants, metadata):
+    """
+    Summarize a gene's results across datasets: the lowest p-value in each analysis group (and the
+    field it is from) and the number of variants in each dataset.
+    """
+    summary = {"gene_id": gene.get("gene_id"), "symbol": gene.get("symbol"), "datasets": {}}
+
+    gene_results = gene.get("gene_results") or {}
+    for dataset, dataset_metadata in metadata["datasets"].items():
+        dataset_summary = {"n_variants": n_variants.get(dataset, 0), "analysis_groups": {}}
+
+        dataset_gene_results = gene_results.get(dataset)
+        if dataset_gene_results:
+            p_value_fields = [
+                (i, field)
+                for i, field in enumerate(dataset_metadata["gene_group_result_field_names"])
+                if dataset_metadata["gene_group_result_field_types"][i] == "float"
+                and P_VALUE_FIELD_PATTERN.search(field)
+            ]
+            for analysis_group, group_result in zip(
+                dataset_metadata["gene_result_analysis_groups"], dataset_gene_results["group_results"]
+            ):
+                if not group_result:
+                    continue
+                p_values = [
+                    (group_result[i], field)
+                    for i, field in p_value_fields
+                    if isinstance(group_result[i], (int, float)) and group_result[i] == group_result[i]
+                ]
+                if p_values:
+                    p_value, field = min(p_values)
+                    dataset_summary["analysis_groups"][analysis_group] = {"p_value": p_value, "field": field}
+
+        if dataset_summary["n_variants"] or dataset_summary["analysis_groups"]:
+            summary["datasets"][dataset] = dataset_summary
+
+    return summary
+
+
+def split_data(
+    row,
+    metadata=None,
+    variant_page_size=None,
+    variant_paging_threshold=None,
+    split_variant_analysis_groups=False,
+    binary_variants=False,
+    gene_summaries=False,
+    gene_bundles=False,
+    field_encodings=None,
+    bytes_saved=None,
+    field_bytes=None,
+    timer=None,
+):
+    """
+    Split a row of the combined table into files for the gene and its variants in each dataset.
+
+    Yields file name and content for each file. Variants are decoded and encoded one dataset at a time
+    (or one variant at a time, if no other outputs require the list of variants) so that the entire row
+    is never decoded at once.
+
+    If `field_encodings` are given, they are applied to gene and variant results and the bytes saved
+    for each dataset and field are added to `bytes_saved`.
+
+    If `gene_summaries` is set, also yields a summary of the gene's results across datasets.
+
+    If `gene_bundles` is set, also yields a file for each dataset containing the gene (for the dataset's
+    reference genome) and its variants, or the first page of variants if the variants are paged.
+
+    If `field_bytes` is given, the number of bytes used by each field in a sample of variants is
+    counted for each dataset.
+
+    If a `timer` is given, time spent decoding the row is recorded in its "parse" phase and time spent
+    encoding variants and gene files in its "encode" phase.
+    """
+    timer = timer or NullPhaseTimer()
+
+    field_encodings = field_encodings or {}
+    if bytes_saved is None:
+        bytes_saved = {}
+
     gene_id = row[0]
-    gene = json.loads(row[1])
-    all_variants = gene.pop("variants")
-    gene_grch37 = gene.pop("GRCh37")
-    gene_grch38 = gene.pop("GRCh38")
+    cursor = JSONCursor(row[1])
+    encoder = ResultEncoder()
+
+    gene = {}
+    n_variants = {}
+    bundled_variants = {}
+    gene_grch37 = None
+    gene_grch38 = None
+
+    for key in cursor.iter_object_keys():
+        if key == "GRCh37":
+            with timer.phase("parse"):
+                gene_grch37 = cursor.decode()
+        elif key == "GRCh38":
+            with timer.phase("parse"):
+                gene_grch38 = cursor.decode()
+        elif key == "variants":
+            for dataset in cursor.iter_object_keys():
+                variants = timer.timed(cursor.iter_array_values(), "parse")
+                if dataset in field_encodings:
+                    variants = (
+                        encode_variant_fields(
+                            variant,
+                            metadata["variant_fields"],
+                            metadata["datasets"][dataset],
+                            field_encodings[dataset],
+                            bytes_saved.setdefault(dataset, collections.Counter()),
+                        )
+                        for variant in variants
+                    )
+
+                if field_bytes is not None:
+                    variants = sample_variant_field_bytes(
+                        variants,
+                        metadata["variant_fields"],
+                        metadata["datasets"][dataset],
+                        field_bytes.setdefault(
+                            dataset, {"n_variants": 0, "n_sampled": 0, "fields": collections.Counter()}
+                        ),
+                    )
+
+                if variant_page_size or split_variant_analysis_groups or binary_variants:
+                    dataset_variants = list(variants)
+                    with timer.phase("encode"):
+                        encoded_variants = [encoder.encode(variant) for variant in dataset_variants]
+                else:
+                    dataset_variants = None
+                    with timer.phase("encode"):
+                        encoded_variants = [encoder.encode(variant) for variant in variants]
+
+                n_variants[dataset] = len(encoded_variants)
+
+                variants_json = "[" + ",".join(encoded_variants) + "]"
+                del encoded_variants
+                yield f"{gene_id}_{dataset.lower()}_variants.json", '{"variants":' + variants_json + "}"
+
+                if gene_bundles:
+                    bundled_variants[dataset] = {"variants": variants_json}
+                del variants_json
+
+                if variant_page_size:
+                    for file_name, data in split_variants_data(
+                        gene_id, dataset, dataset_variants, metadata, variant_page_size, variant_paging_threshold
+                    ):
+                        if gene_bundles and file_name.endswith("_variants_pages.json"):
+                            bundled_variants[dataset]["variants_pages"] = data
+                        elif gene_bundles and file_name.endswith("_variants_page_0.json"):
+                            # Page files contain {"variants":[...]}
+                            bundled_variants[dataset]["variants"] = data[len('{"variants":') : -1]
+                        yield file_name, data
+
+                if split_variant_analysis_groups:
+                    yield from split_analysis_groups_data(gene_id, dataset, dataset_variants, metadata)
+
+                if binary_variants:
+                    yield f"{gene_id}_{dataset.lower()}_variants.bin", encode_variants(
+                        dataset_variants, metadata["variant_fields"], metadata["datasets"][dataset]
+                    )
+        else:
+            with timer.phase("parse"):
+                gene[key] = cursor.decode()
+
+    if gene_summaries:
+        yield f"{gene_id}_summary.json", json.dumps(get_gene_summary(gene, n_variants, metadata), cls=ResultEncoder)
+
+    for dataset, dataset_gene_results in (gene.get("gene_results") or {}).items():
+        if dataset in field_encodings and dataset_gene_results:
+            dataset_gene_results["group_results"] = encode_gene_group_results(
+                dataset_gene_results["group_results"],
+                metadata["datasets"][dataset],
+                field_encodings[dataset],
+                bytes_saved.setdefault(dataset, collections.Counter()),
+            )
+
+    gene_json = {}
 
     if gene_grch37:
         gene_grch37 = {**gene, "reference_genome": "GRCh37", **gene_grch37}
-        gene_grch37 = json.dumps({"gene": gene_grch37}, cls=ResultEncoder)
+        with timer.phase("encode"):
+            gene_json["GRCh37"] = json.dumps(gene_grch37, cls=ResultEncoder)
+        yield f"{gene_id}_GRCh37.json", '{"gene":' + gene_json["GRCh37"] + "}"
 
     if gene_grch38:
         gene_grch38 = {**gene, "reference_genome": "GRCh38", **gene_grch38}
-        gene_grch38 = json.dumps({"gene": gene_grch38}, cls=ResultEncoder)
+        with timer.phase("encode"):
+            gene_json["GRCh38"] = json.dumps(gene_grch38, cls=ResultEncoder)
+        yield f"{gene_id}_GRCh38.json", '{"gene":' + gene_json["GRCh38"] + "}"
 
-    all_variants = {k: json.dumps({"variants": v}, cls=ResultEncoder) for k, v in all_variants.items()}
+    for dataset, dataset_bundled_variants in bundled_variants.items():
+        reference_genome = metadata["datasets"][dataset]["reference_genome"]
+        if reference_genome not in gene_json:
+            continue
 
-    return gene_id, gene_grch37, gene_grch38, all_variants
+        yield f"{gene_id}_{dataset.lower()}_bundle.json", (
+            '{"gene":'
+            + gene_json[reference_genome]
+            + "".join(f',"{key}":{value}' for key, value in dataset_bundled_variants.items())
+            + "}"
+        )
 
 
-def write_data_files(table_path, output_directory, genes=None):
-    if output_directory.startswith("gs://"):
-        raise Exception("Cannot write output to Google Storage")
+def write_file_atomic(path, data):
+    """
+    Write a file by writing to a temporary file and then renaming it, so that an interrupted
+    write never leaves a truncated file at `path`.
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb" if isinstance(data, bytes) else "w") as out_file:
+        out_file.write(data)
+    os.replace(temp_path, path)
 
-    ds = hl.read_table(table_path)
 
-    os.makedirs(output_directory, exist_ok=True)
+class ProgressJournal:
+    """
+    Record of completed steps and genes written, used to resume an interrupted export.
+
+    Each line of the journal file is a JSON object describing one completed step or gene.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.completed_steps = {}
+        self.completed_genes = set()
+        self._n_unsynced = 0
+
+        is_last_line_complete = True
+        if resume and os.path.exists(path):
+            with open(path) as journal_file:
+                for line in journal_file:
+                    is_last_line_complete = line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line may be incomplete if the previous run was interrupted
+                        continue
+
+                    if "gene" in entry:
+                        self.completed_genes.add(entry["gene"])
+                    else:
+                        self.completed_steps[entry["step"]] = entry
+
+        self._file = open(path, "a" if resume else "w")  # pylint: disable=consider-using-with
+        if not is_last_line_complete:
+            self._file.write("\n")
+
+    def _append(self, entry, sync=True):
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        self._n_unsynced += 1
+        if sync or self._n_unsynced >= 1000:
+            os.fsync(self._file.fileno())
+            self._n_unsynced = 0
+
+    def is_step_complete(self, step):
+        return step in self.completed_steps
+
+    def complete_step(self, step, **info):
+        entry = {"step": step, **info}
+        self.completed_steps[step] = entry
+        self._append(entry)
+
+    def complete_gene(self, gene_id):
+        self.completed_genes.add(gene_id)
+        self._append({"gene": gene_id}, sync=False)
+
+    def close(self, remove=False):
+        os.fsync(self._file.fileno())
+        self._file.close()
+        if remove:
+            os.remove(self.path)
+
+
+SQLITE_TABLES = [
+    "CREATE TABLE IF NOT EXISTS metadata (data TEXT NOT NULL)",
+    """
+    CREATE TABLE IF NOT EXISTS genes (
+        gene_id TEXT NOT NULL,
+        reference_genome TEXT NOT NULL,
+        symbol TEXT,
+        chrom TEXT,
+        start INTEGER,
+        stop INTEGER,
+        data TEXT NOT NULL,
+        PRIMARY KEY (gene_id, reference_genome)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS gene_results (
+        dataset TEXT NOT NULL,
+        gene_id TEXT NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (dataset, gene_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS variants (
+        dataset TEXT NOT NULL,
+        gene_id TEXT NOT NULL,
+        variant_id TEXT NOT NULL,
+        chrom TEXT,
+        pos INTEGER,
+        data TEXT NOT NULL,
+        PRIMARY KEY (dataset, gene_id, variant_id)
+    )
+    """,
+]
+
+# Indexes are created after all rows are inserted, which is faster than updating them for each row.
+SQLITE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS genes_symbol ON genes (symbol)",
+    "CREATE INDEX IF NOT EXISTS variants_variant_id ON variants (variant_id)",
+    "CREATE INDEX IF NOT EXISTS variants_position ON variants (dataset, chrom, pos)",
+]
+
+
+def open_sqlite_database(path, journal_mode="WAL"):
+    connection = sqlite3.connect(path)
+    connection.execute(f"PRAGMA journal_mode={journal_mode}")
+    connection.execute("PRAGMA synchronous=OFF")
+    with connection:
+        for statement in SQLITE_TABLES:
+            connection.execute(statement)
+    return connection
+
+
+_sqlite_shard = None  # pylint: disable=invalid-name
+
+
+def get_sqlite_shard(sqlite_path):
+    """
+    Get the SQLite database that the current worker process writes rows to.
+
+    Since only one process can write to a SQLite database at a time, each worker process writes
+    to a separate database and the parent process merges them after all genes are written.
+    """
+    global _sqlite_shard  # pylint: disable=global-statement,invalid-name
+    if _sqlite_shard is None:
+        _sqlite_shard = open_sqlite_database(f"{sqlite_path}.shard-{os.getpid()}", journal_mode="DELETE")
+    return _sqlite_shard
+
+
+def write_sqlite_rows(connection, gene_id, file_name, data, metadata):
+    """
+    Insert rows for a gene or variants file into a SQLite database.
+    """
+    for reference_genome in ("GRCh37", "GRCh38"):
+        if file_name == f"{gene_id}_{reference_genome}.json":
+            gene = json.loads(data)["gene"]
+            connection.execute(
+                "INSERT OR REPLACE INTO genes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (gene_id, reference_genome, gene["symbol"], gene["chrom"], gene["start"], gene["stop"], data),
+            )
+            return
+
+    pos_index = metadata["variant_fields"].index("pos")
+    variant_id_index = metadata["variant_fields"].index("variant_id")
+
+    for dataset in metadata["datasets"]:
+        if file_name == f"{gene_id}_{dataset.lower()}_variants.json":
+            cursor = JSONCursor(data)
+            for _ in cursor.iter_object_keys():
+                connection.executemany(
+                    "INSERT OR REPLACE INTO variants VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        (
+                            dataset.lower(),
+                            gene_id,
+                            variant[variant_id_index],
+                            variant[variant_id_index].split("-")[0],
+                            variant[pos_index],
+                            encoded_variant,
+                        )
+                        for variant, encoded_variant in cursor.iter_array_encoded_values()
+                    ),
+                )
+            return
+
+
+def merge_sqlite_shards(sqlite_path):
+    """
+    Copy rows from all worker databases into the main database and index it.
+    """
+    connection = open_sqlite_database(sqlite_path)
+    shard_paths = [path for path in glob.glob(f"{sqlite_path}.shard-*") if not path.endswith("-journal")]
+    for shard_path in shard_paths:
+        connection.execute("ATTACH DATABASE ? AS shard", (shard_path,))
+        with connection:
+            # Remove variants of rewritten genes, so that variants that are no longer in the gene's results are
+            # not left behind when updating an existing database
+            connection.execute("DELETE FROM variants WHERE gene_id IN (SELECT gene_id FROM shard.genes)")
+            connection.execute("INSERT OR REPLACE INTO genes SELECT * FROM shard.genes")
+            connection.execute("INSERT OR REPLACE INTO variants SELECT * FROM shard.variants")
+        connection.execute("DETACH DATABASE shard")
+        os.remove(shard_path)
 
-    with open(f"{output_directory}/metadata.json", "w") as output_file:
-        output_file.write(hl.eval(hl.json(ds.globals.meta)))
+    with connection:
+        for statement in SQLITE_INDEXES:
+            connection.execute(statement)
 
+    connection.close()
+
+
+def write_search_terms_file(ds, output_directory):
     gene_search_terms = ds.select(data=hl.json(hl.tuple([ds.gene_id, ds.search_terms])))
-    gene_search_terms.key_by().select("data").export(f"{output_directory}/gene_search_terms.json.txt", header=False)
-    os.remove(f"{output_directory}/.gene_search_terms.json.txt.crc")
+    gene_search_terms.key_by().select("data").export(f"{output_directory}/gene_search_terms.json.txt.tmp", header=False)
+    os.remove(f"{output_directory}/.gene_search_terms.json.txt.tmp.crc")
+    os.replace(f"{output_directory}/gene_search_terms.json.txt.tmp", f"{output_directory}/gene_search_terms.json.txt")
 
-    ds = ds.drop("previous_symbols", "alias_symbols", "search_terms")
 
+def rank_gene_results(gene_results, group_index, field_index):
+    """
+    Get indices of gene results with a value for a field in an analysis group, sorted by that value.
+    """
+    values = []
+    for i, result in enumerate(gene_results):
+        group_result = result[5][group_index]
+        value = group_result[field_index] if group_result else None
+        if isinstance(value, (int, float)) and value == value:
+            values.append((value, result[0], i))
+
+    return [i for _, _, i in sorted(values)]
+
+
+def write_top_hits_files(output_directory, dataset, gene_results, rankings, offsets, top_hits_size):
+    """
+    Write the top ranked gene results and an index of all ranked results for each analysis group
+    and p-value field.
+
+    The index lists the position of each ranked result in `results/{dataset}.json` and the byte range
+    of its entry in that file, so that clients can request further results with HTTP range requests.
+    """
+    for (analysis_group, field), ranked_indices in rankings.items():
+        top_hits_directory = (
+            f"{output_directory}/results/{dataset.lower()}/top_hits/{get_file_name_slug(analysis_group)}"
+        )
+        os.makedirs(top_hits_directory, exist_ok=True)
+
+        file_name = get_file_name_slug(field)
+        write_file_atomic(
+            f"{top_hits_directory}/{file_name}.json",
+            json.dumps(
+                {
+                    "analysis_group": analysis_group,
+                    "field": field,
+                    "n_results": len(ranked_indices),
+                    "results": [gene_results[i] for i in ranked_indices[:top_hits_size]],
+                },
+                cls=ResultEncoder,
+            ),
+        )
+        write_file_atomic(
+            f"{top_hits_directory}/{file_name}_index.json",
+            json.dumps(
+                {
+                    "analysis_group": analysis_group,
+                    "field": field,
+                    "results_file": f"results/{dataset.lower()}.json",
+                    "rows": ranked_indices,
+                    "offsets": [offsets[i] for i in ranked_indices],
+                },
+                separators=(",", ":"),
+            ),
+        )
+
+
+def write_gene_results_files(
+    ds, output_directory, sqlite_path=None, metadata=None, field_encodings=None, top_hits_size=None
+):
     os.makedirs(f"{output_directory}/results", exist_ok=True)
     for dataset in ds.globals.meta.datasets.dtype.fields:
         reference_genome = "GRCh38" if dataset == "bipex" else "GRCh37"
@@ -108,52 +958,605 @@ def write_data_files(table_path, output_directory, genes=None):
 
         gene_results = [r.result for r in gene_results]
 
-        with open(f"{output_directory}/results/{dataset.lower()}.json", "w") as output_file:
-            output_file.write(json.dumps({"results": gene_results}, cls=ResultEncoder))
+        # Rank results before field encodings are applied, since encodings may not preserve order
+        rankings = {}
+        if top_hits_size:
+            dataset_metadata = metadata["datasets"][dataset]
+            for group_index, analysis_group in enumerate(dataset_metadata["gene_result_analysis_groups"]):
+                for field_index, field in enumerate(dataset_metadata["gene_group_result_field_names"]):
+                    if dataset_metadata["gene_group_result_field_types"][
+                        field_index
+                    ] == "float" and P_VALUE_FIELD_PATTERN.search(field):
+                        rankings[(analysis_group, field)] = rank_gene_results(gene_results, group_index, field_index)
 
-    if genes:
-        ds = ds.filter(hl.set(genes).contains(ds.gene_id))
+        if field_encodings and dataset in field_encodings:
+            bytes_saved = collections.Counter()
+            gene_results = [
+                (
+                    *result[:5],
+                    encode_gene_group_results(
+                        result[5], metadata["datasets"][dataset], field_encodings[dataset], bytes_saved
+                    ),
+                )
+                for result in gene_results
+            ]
+            print_bytes_saved({dataset: bytes_saved}, f"results/{dataset.lower()}.json")
+
+        # Encode results individually to record the byte range of each result in the file
+        encoded_results = [json.dumps(result, cls=ResultEncoder) for result in gene_results]
+        offsets = []
+        offset = len('{"results":[')
+        for encoded_result in encoded_results:
+            offsets.append((offset, offset + len(encoded_result)))
+            offset += len(encoded_result) + 1
+
+        write_file_atomic(
+            f"{output_directory}/results/{dataset.lower()}.json",
+            '{"results":[' + ",".join(encoded_results) + "]}",
+        )
+        del encoded_results
+
+        if rankings:
+            write_top_hits_files(output_directory, dataset, gene_results, rankings, offsets, top_hits_size)
+
+        if sqlite_path:
+            connection = open_sqlite_database(sqlite_path)
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO gene_results VALUES (?, ?, ?)",
+                    ((dataset.lower(), result[0], json.dumps(result, cls=ResultEncoder)) for result in gene_results),
+                )
+            connection.close()
+
+
+def parquet_column_name(field_name):
+    """
+    Replace characters that are not allowed in Parquet column names.
+    """
+    return re.sub(r"[ ,;{}()\n\t=/]+", "_", field_name).strip("_")
+
+
+def write_parquet_files(ds, parquet_directory, metadata):
+    """
+    Write gene results and variant results for each dataset as Parquet files, with one row per
+    gene or variant and analysis group. Files are partitioned by dataset and chromosome.
+    """
+    for dataset, dataset_metadata in metadata["datasets"].items():
+        reference_genome = dataset_metadata["reference_genome"]
+
+        gene_results = ds.filter(hl.is_defined(ds.gene_results[dataset]))
+        gene_results = gene_results.select(
+            symbol=gene_results.symbol,
+            chrom=gene_results[reference_genome].chrom,
+            group_results=hl.zip(
+                hl.literal(dataset_metadata["gene_result_analysis_groups"], hl.tarray(hl.tstr)),
+                gene_results.gene_results[dataset].group_results,
+            ),
+        )
+        gene_results = gene_results.explode(gene_results.group_results)
+        gene_results = gene_results.transmute(
+            analysis_group=gene_results.group_results[0],
+            **{
+                parquet_column_name(field): gene_results.group_results[1][i]
+                for i, field in enumerate(dataset_metadata["gene_group_result_field_names"])
+            },
+        )
+        gene_results.to_spark().write.mode("overwrite").partitionBy("chrom").parquet(
+            f"{parquet_directory}/gene_results/dataset={dataset.lower()}"
+        )
+
+        variant_fields = metadata["variant_fields"]
+        variants = ds.select(variant=ds.variants[dataset])
+        variants = variants.explode(variants.variant)
+        variant = variants.variant
+        variants = variants.select(
+            chrom=variant[variant_fields.index("variant_id")].split("-")[0],
+            **{
+                field: variant[variant_fields.index(field)]
+                for field in variant_fields
+                if field not in ("info", "group_results")
+            },
+            **{
+                f"info_{parquet_column_name(field)}": variant[variant_fields.index("info")][i]
+                for i, field in enumerate(dataset_metadata["variant_info_field_names"])
+            },
+            group_results=hl.zip(
+                hl.literal(dataset_metadata["variant_result_analysis_groups"], hl.tarray(hl.tstr)),
+                variant[variant_fields.index("group_results")],
+            ),
+        )
+        variants = variants.explode(variants.group_results)
+        variants = variants.filter(hl.is_defined(variants.group_results[1]))
+        variants = variants.transmute(
+            analysis_group=variants.group_results[0],
+            **{
+                parquet_column_name(field): variants.group_results[1][i]
+                for i, field in enumerate(dataset_metadata["variant_group_result_field_names"])
+            },
+        )
+        variants.to_spark().write.mode("overwrite").partitionBy("chrom").parquet(
+            f"{parquet_directory}/variant_results/dataset={dataset.lower()}"
+        )
+
+
+def get_gene_directory(output_directory, gene_id):
+    num = int(gene_id.lstrip("ENSGR"))
+    return f"{output_directory}/genes/{str(num % 1000).zfill(3)}"
+
+
+GeneStatus = collections.namedtuple(
+    "GeneStatus", ["gene_id", "n_files", "n_bytes", "file_sizes", "field_bytes", "bytes_saved", "time", "phases"]
+)
+
+
+def get_file_dataset(gene_id, file_name, metadata):
+    """
+    Get the dataset that a gene's file belongs to, or "gene" for files that are not specific to a dataset.
+    """
+    for dataset in metadata["datasets"]:
+        if file_name.startswith(f"{gene_id}_{dataset.lower()}_"):
+            return dataset
+    return "gene"
+
+
+def write_gene_data(
+    row, output_directory, metadata, write_files=True, sqlite_path=None, profile=False, **split_data_options
+):
+    """
+    Split a row of the combined table into files and write them.
+
+    Returns a small status record so that workers do not send file contents back to the parent process.
+
+    The status record includes the size of the gene's files for each dataset and the bytes used by each
+    field in a sample of variants.
 
+    If `profile` is set, the status record includes time spent in each phase of processing the row:
+    parse, encode, write, and split (everything else, including deriving paged and other optional outputs).
+    """
+    start_time = time.perf_counter()
+    timer = PhaseTimer() if profile else NullPhaseTimer()
+    bytes_saved = {}
+    field_bytes = {}
+    file_sizes = collections.Counter()
+
+    gene_id = row[0]
+    gene_dir = get_gene_directory(output_directory, gene_id)
+
+    sqlite_connection = get_sqlite_shard(sqlite_path) if sqlite_path else None
+
+    n_files = 0
+    n_bytes = 0
+    with timer.phase("split"):
+        for file_name, data in split_data(
+            row, metadata=metadata, bytes_saved=bytes_saved, field_bytes=field_bytes, timer=timer, **split_data_options
+        ):
+            with timer.phase("write"):
+                if write_files:
+                    write_file_atomic(f"{gene_dir}/{file_name}", data)
+                if sqlite_connection:
+                    write_sqlite_rows(sqlite_connection, gene_id, file_name, data, metadata)
+            n_files += 1
+            n_bytes += len(data)
+            file_sizes[get_file_dataset(gene_id, file_name, metadata)] += len(data)
+
+        # Insert all of a gene's rows in one transaction
+        if sqlite_connection:
+            with timer.phase("write"):
+                sqlite_connection.commit()
+
+    return GeneStatus(
+        gene_id,
+        n_files,
+        n_bytes,
+        file_sizes,
+        field_bytes,
+        bytes_saved,
+        time.perf_counter() - start_time,
+        timer.times if profile else None,
+    )
+
+
+def print_bytes_saved(bytes_saved, description):
+    """
+    Print the number of bytes saved by field encodings for each dataset and field.
+    """
+    for dataset, dataset_bytes_saved in sorted(bytes_saved.items()):
+        for field, n_bytes in dataset_bytes_saved.most_common():
+            print(f"Encoding {dataset} {field} saved {n_bytes} bytes in {description}")
+
+
+def bounded_iterator(iterable, semaphore):
+    """
+    Acquire the semaphore before yielding each item, so that at most a fixed number of items
+    are read ahead of the items that have been processed.
+    """
+    for item in iterable:
+        semaphore.acquire()
+        yield item
+
+
+def write_gene_files(
+    ds,
+    output_directory,
+    metadata,
+    journal,
+    processes=None,
+    chunksize=1,
+    max_in_flight=None,
+    write_files=True,
+    sqlite_path=None,
+    profile_directory=None,
+    **split_data_options,
+):
     temp_file_name = "temp.tsv"
-    n_rows = ds.count()
-    ds.select(data=hl.json(ds.row)).export(f"{output_directory}/{temp_file_name}", header=False)
+    if journal.is_step_complete("export"):
+        n_rows = journal.completed_steps["export"]["n_rows"]
+    else:
+        n_rows = ds.count()
+        ds.select(data=hl.json(ds.row)).export(f"{output_directory}/{temp_file_name}", header=False)
+        journal.complete_step("export", n_rows=n_rows)
 
     csv.field_size_limit(sys.maxsize)
-    os.makedirs(f"{output_directory}/genes", exist_ok=True)
+    phase_times = collections.Counter()
+    if write_files:
+        directories_start_time = time.perf_counter()
+        for num in range(1000):
+            os.makedirs(f"{output_directory}/genes/{str(num).zfill(3)}", exist_ok=True)
+        phase_times["directories"] = time.perf_counter() - directories_start_time
+
+    process_row = functools.partial(
+        write_gene_data,
+        output_directory=output_directory,
+        metadata=metadata,
+        write_files=write_files,
+        sqlite_path=sqlite_path,
+        profile=bool(profile_directory),
+        **split_data_options,
+    )
 
-    with multiprocessing.get_context("spawn").Pool() as pool:
+    pool_options = {}
+    if profile_directory:
+        os.makedirs(profile_directory, exist_ok=True)
+        remove_worker_profiles(profile_directory)
+        pool_options = {"initializer": start_worker_profiler, "initargs": (profile_directory,)}
+
+    processes = processes or os.cpu_count()
+    # Rows are read ahead in the parent process only up to this limit. It must be at least
+    # chunksize for chunks to be filled.
+    max_in_flight = max(max_in_flight or 4 * processes * chunksize, chunksize)
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    n_genes = 0
+    n_files = 0
+    n_bytes = 0
+    bytes_saved = {}
+    gene_sizes = {}
+    field_bytes = {}
+    gene_times = []
+    start_time = time.time()
+
+    with multiprocessing.get_context("spawn").Pool(processes, **pool_options) as pool:
         with open(f"{output_directory}/{temp_file_name}") as data_file:
 
             reader = csv.reader(data_file, delimiter="\t")
-            for gene_id, gene_grch37, gene_grch38, all_variants in tqdm(pool.imap(split_data, reader), total=n_rows):
-                num = int(gene_id.lstrip("ENSGR"))
-                gene_dir = f"{output_directory}/genes/{str(num % 1000).zfill(3)}"
-                os.makedirs(gene_dir, exist_ok=True)
+            # Skip genes written before a previous run was interrupted
+            reader = (row for row in reader if row[0] not in journal.completed_genes)
+            for gene_status in tqdm(
+                pool.imap_unordered(process_row, bounded_iterator(reader, in_flight), chunksize=chunksize),
+                initial=len(journal.completed_genes),
+                total=n_rows,
+            ):
+                in_flight.release()
+                journal.complete_gene(gene_status.gene_id)
+                n_genes += 1
+                n_files += gene_status.n_files
+                n_bytes += gene_status.n_bytes
+                for dataset, dataset_bytes_saved in gene_status.bytes_saved.items():
+                    bytes_saved.setdefault(dataset, collections.Counter()).update(dataset_bytes_saved)
+                for dataset, size in gene_status.file_sizes.items():
+                    gene_sizes.setdefault(dataset, []).append((gene_status.gene_id, size))
+                for dataset, dataset_field_bytes in gene_status.field_bytes.items():
+                    total_field_bytes = field_bytes.setdefault(
+                        dataset, {"n_variants": 0, "n_sampled": 0, "fields": collections.Counter()}
+                    )
+                    total_field_bytes["n_variants"] += dataset_field_bytes["n_variants"]
+                    total_field_bytes["n_sampled"] += dataset_field_bytes["n_sampled"]
+                    total_field_bytes["fields"].update(dataset_field_bytes["fields"])
+                if profile_directory:
+                    gene_times.append((gene_status.gene_id, gene_status.time))
+                    phase_times.update(gene_status.phases)
 
-                if gene_grch37:
-                    with open(f"{gene_dir}/{gene_id}_GRCh37.json", "w") as out_file:
-                        out_file.write(gene_grch37)
+        # Let workers exit normally so that they write their profiles
+        pool.close()
+        pool.join()
 
-                if gene_grch38:
-                    with open(f"{gene_dir}/{gene_id}_GRCh38.json", "w") as out_file:
-                        out_file.write(gene_grch38)
+    elapsed_time = time.time() - start_time
+    print(
+        f"Wrote {n_files} files ({n_bytes} bytes) for {n_genes} genes in {elapsed_time:.1f}s "
+        f"with {processes} processes ({n_genes / elapsed_time:.1f} genes/s)"
+    )
+    print_bytes_saved(bytes_saved, "gene files")
 
-                for dataset, dataset_variants in all_variants.items():
-                    if dataset_variants:
-                        with open(f"{gene_dir}/{gene_id}_{dataset.lower()}_variants.json", "w") as out_file:
-                            out_file.write(dataset_variants)
+    if profile_directory:
+        write_profile_report(profile_directory, phase_times, gene_times)
+
+    if sqlite_path:
+        merge_sqlite_shards(sqlite_path)
 
     os.remove(f"{output_directory}/{temp_file_name}")
     os.remove(f"{output_directory}/.{temp_file_name}.crc")
 
+    return gene_sizes, field_bytes
+
+
+def write_data_files(
+    table_path,
+    output_directory,
+    genes=None,
+    genes_only=False,
+    variant_page_size=None,
+    variant_paging_threshold=None,
+    split_variant_analysis_groups=False,
+    processes=None,
+    chunksize=1,
+    max_in_flight=None,
+    resume=False,
+    write_files=True,
+    sqlite_path=None,
+    parquet_directory=None,
+    binary_variants=False,
+    top_hits_size=None,
+    gene_summaries=False,
+    gene_bundles=False,
+    profile_directory=None,
+    previous_size_report_path=None,
+):
+    if output_directory.startswith("gs://"):
+        raise Exception("Cannot write output to Google Storage")
+
+    if genes_only and not genes:
+        raise Exception("Genes to write must be specified to only write gene files")
+
+    ds = hl.read_table(table_path)
+
+    os.makedirs(output_directory, exist_ok=True)
+
+    previous_size_report = read_size_report(previous_size_report_path or f"{output_directory}/size_report.json")
+
+    journal = ProgressJournal(f"{output_directory}/.write_results_files_progress", resume=resume)
+
+    if sqlite_path and not resume:
+        # Worker databases left over from an interrupted run are discarded. A full export starts a new database,
+        # but when only some genes are written, their rows are replaced in the existing database.
+        paths = glob.glob(f"{sqlite_path}.shard-*")
+        if not genes:
+            paths.extend([sqlite_path, f"{sqlite_path}-wal", f"{sqlite_path}-shm"])
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    metadata = hl.eval(hl.json(ds.globals.meta))
+
+    field_encodings = get_field_encodings(PIPELINE_CONFIG_PATH, json.loads(metadata))
+    if field_encodings:
+        # Record encodings in metadata so that clients can interpret encoded values
+        metadata = json.loads(metadata)
+        for dataset, dataset_encodings in field_encodings.items():
+            dataset_metadata = metadata["datasets"][dataset]
+            dataset_metadata["field_encodings"] = {
+                result_type: {
+                    field: ":".join(str(part) for part in policy if part is not None)
+                    for field, policy in zip(dataset_metadata[f"{result_type}_field_names"], policies)
+                    if policy
+                }
+                for result_type, policies in dataset_encodings.items()
+            }
+        metadata = json.dumps(metadata, separators=(",", ":"))
+
+    if not genes_only and not journal.is_step_complete("metadata"):
+        write_file_atomic(f"{output_directory}/metadata.json", metadata)
+        if sqlite_path:
+            connection = open_sqlite_database(sqlite_path)
+            with connection:
+                connection.execute("DELETE FROM metadata")
+                connection.execute("INSERT INTO metadata VALUES (?)", (metadata,))
+            connection.close()
+        journal.complete_step("metadata")
+
+    if not genes_only and not journal.is_step_complete("search_terms"):
+        write_search_terms_file(ds, output_directory)
+        journal.complete_step("search_terms")
+
+    ds = ds.drop("previous_symbols", "alias_symbols", "search_terms")
+
+    if not genes_only and not journal.is_step_complete("gene_results"):
+        write_gene_results_files(
+            ds,
+            output_directory,
+            sqlite_path=sqlite_path,
+            metadata=json.loads(metadata),
+            field_encodings=field_encodings,
+            top_hits_size=top_hits_size,
+        )
+        journal.complete_step("gene_results")
+
+    if parquet_directory and not genes_only and not journal.is_step_complete("parquet"):
+        write_parquet_files(ds, parquet_directory, json.loads(metadata))
+        journal.complete_step("parquet")
+
+    if genes:
+        # Filter on the table's key so that only partitions containing the selected genes are read
+        ds = hl.filter_intervals(ds, [hl.interval(gene_id, gene_id, includes_end=True) for gene_id in genes])
+
+    # Size reports can only be compared if they include all genes
+    is_size_report_complete = not genes and not journal.completed_genes
+
+    gene_sizes, field_bytes = write_gene_files(
+        ds,
+        output_directory,
+        json.loads(metadata),
+        journal,
+        variant_page_size=variant_page_size,
+        variant_paging_threshold=variant_paging_threshold,
+        split_variant_analysis_groups=split_variant_analysis_groups,
+        binary_variants=binary_variants,
+        gene_summaries=gene_summaries,
+        gene_bundles=gene_bundles,
+        field_encodings=field_encodings,
+        processes=processes,
+        chunksize=chunksize,
+        max_in_flight=max_in_flight,
+        write_files=write_files,
+        sqlite_path=sqlite_path,
+        profile_directory=profile_directory,
+    )
+
+    journal.close(remove=True)
+
+    other_file_sizes = {}
+    for dataset in json.loads(metadata)["datasets"]:
+        gene_results_file_path = f"{output_directory}/results/{dataset.lower()}.json"
+        if os.path.exists(gene_results_file_path):
+            other_file_sizes[dataset] = os.path.getsize(gene_results_file_path)
+
+    size_report = build_size_report(gene_sizes, field_bytes, other_file_sizes, complete=is_size_report_complete)
+    for dataset, dataset_size_report in size_report["datasets"].items():
+        print(
+            f"{dataset}: {dataset_size_report['total_bytes']} bytes, "
+            f"99th percentile gene {dataset_size_report['gene_bytes_p99']} bytes, "
+            f"largest gene {dataset_size_report['gene_bytes_max']} bytes"
+        )
+
+    # Budgets are checked before writing the report, so that a report that exceeds them does not replace
+    # the size_report.json that later runs are compared against
+    rejected_size_report_path = f"{output_directory}/size_report.rejected.json"
+    try:
+        is_within_size_budgets = check_size_budgets(size_report, previous_size_report, PIPELINE_CONFIG_PATH)
+    except Exception:
+        write_file_atomic(rejected_size_report_path, json.dumps(size_report, indent=2))
+        print(f"Wrote size report to {rejected_size_report_path}")
+        raise
+
+    if is_within_size_budgets:
+        size_report_path = f"{output_directory}/size_report{'' if is_size_report_complete else '.partial'}.json"
+    else:
+        size_report_path = rejected_size_report_path
+    write_file_atomic(size_report_path, json.dumps(size_report, indent=2))
+    print(f"Wrote size report to {size_report_path}")
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("combined_hail_table")
     parser.add_argument("output_directory")
-    parser.add_argument("--genes", nargs="+")
+    parser.add_argument("--genes", nargs="+", help="Only write gene and variant files for these genes")
+    parser.add_argument(
+        "--genes-only",
+        action="store_true",
+        help="Skip writing metadata, search terms, and gene results files (requires --genes)",
+    )
+    parser.add_argument(
+        "--variant-page-size",
+        type=int,
+        help="Also write variants for large genes in pages of this many variants, sorted by position",
+    )
+    parser.add_argument(
+        "--variant-paging-threshold",
+        type=int,
+        default=10000,
+        help="Minimum number of variants in a gene for its variants to be split into pages (defaults to %(default)s)",
+    )
+    parser.add_argument(
+        "--split-variant-analysis-groups",
+        action="store_true",
+        help="Also write variant annotations and each analysis group's variant results to separate files",
+    )
+    parser.add_argument(
+        "--processes", type=int, help="Number of worker processes for writing gene files (defaults to number of CPUs)"
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=1,
+        help="Number of genes sent to a worker process at a time (defaults to %(default)s)",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        help="Maximum number of genes read ahead of those written (defaults to 4 * processes * chunksize)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run, skipping completed steps and genes (use the same arguments as that run)",
+    )
+    parser.add_argument(
+        "--sqlite-database",
+        help="Also write genes, gene results, and variants to a SQLite database at this path",
+    )
+    parser.add_argument(
+        "--skip-gene-files",
+        action="store_true",
+        help="Do not write gene and variant JSON files (for use with --sqlite-database)",
+    )
+    parser.add_argument(
+        "--parquet-directory",
+        help="Also write gene results and variant results as Parquet files partitioned by dataset and chromosome",
+    )
+    parser.add_argument(
+        "--binary-variants",
+        action="store_true",
+        help="Also write variants in a compact binary encoding (see data_pipeline/binary_encoding.py)",
+    )
+    parser.add_argument(
+        "--top-hits",
+        type=int,
+        metavar="N",
+        help="Also write the top N gene results for each analysis group and p-value field, "
+        "with an index of all ranked results",
+    )
+    parser.add_argument(
+        "--gene-summaries",
+        action="store_true",
+        help="Also write a summary of each gene's results across datasets",
+    )
+    parser.add_argument(
+        "--gene-bundles",
+        action="store_true",
+        help="Also write each gene with each dataset's variants (or first page of variants) in one file",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIRECTORY",
+        help="Profile worker processes and write a report of time spent per phase and per gene to this directory",
+    )
+    parser.add_argument(
+        "--previous-size-report",
+        help="Size report to check size budgets against (defaults to size_report.json in the output directory)",
+    )
     args = parser.parse_args()
 
     hl.init()
 
-    write_data_files(args.combined_hail_table, args.output_directory, args.genes)
+    write_data_files(
+        args.combined_hail_table,
+        args.output_directory,
+        args.genes,
+        genes_only=args.genes_only,
+        variant_page_size=args.variant_page_size,
+        variant_paging_threshold=args.variant_paging_threshold,
+        split_variant_analysis_groups=args.split_variant_analysis_groups,
+        processes=args.processes,
+        chunksize=args.chunksize,
+        max_in_flight=args.max_in_flight,
+        resume=args.resume,
+        write_files=not args.skip_gene_files,
+        sqlite_path=args.sqlite_database,
+        parquet_directory=args.parquet_directory,
+        binary_variants=args.binary_variants,
+        top_hits_size=args.top_hits,
+        gene_summaries=args.gene_summaries,
+        gene_bundles=args.gene_bundles,
+        profile_directory=args.profile,
+        previous_size_report_path=args.previous_size_report,
+    )